@@ -1,259 +1,1068 @@
-from flask import Flask, request, render_template, send_from_directory, url_for
+from flask import (Blueprint, Flask, Response, abort, current_app, g, has_request_context,
+                   jsonify, request, render_template, send_file, stream_with_context, url_for)
+import io
+import json
+import multiprocessing
 import re
 import os
-from docx import Document
+import sys
+import sqlite3
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from itertools import accumulate
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from code_matcher import CodeMatcher
+from parse_cache import ParseCache, content_key
+from code_lists import read_code_list
+from comparison import category_counts, compare_codes, index_categories, results_page
+from jobs import FileJobStore, JobQueueFull, JobRunner
+from reports import EXPORT_MIMETYPES, ReportStore, iter_export
+from catalog import CodeCatalog
+from description_rules import RuleSet
+from revisions import Revision, extract_revision, revision_delta
+from upload_limits import DocumentRejected, SpoolingRequest, check_document
+from metrics import Metrics
+from occurrences import OccurrenceIndex
+from near_matches import suggest_near_matches
 
-app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+def load_config(config):
+    # Settings from the environment, with their defaults
+    # Report manifests and their exports, shared by all workers
+    config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
+    # 'python-docx' walks the object model, 'streaming' reads document.xml incrementally
+    config['EXTRACTION_ENGINE'] = os.environ.get('EXTRACTION_ENGINE', 'python-docx')
+    # Report manifests in UPLOAD_FOLDER are removed after REPORT_TTL seconds
+    config['REPORT_TTL'] = int(os.environ.get('REPORT_TTL', 60 * 60))
 
-def extract_text_from_docx(file):
-    doc = Document(file)
-    full_text = []
+    # Parsed documents are cached by content hash: PARSE_CACHE_SIZE entries per worker,
+    # plus a directory shared by all workers (empty PARSE_CACHE_DIR disables it)
+    config['PARSE_CACHE_DIR'] = os.environ.get(
+        'PARSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'werscode-parse-cache'))
+    config['PARSE_CACHE_SIZE'] = int(os.environ.get('PARSE_CACHE_SIZE', 16))
+    config['PARSE_CACHE_TTL'] = int(os.environ.get('PARSE_CACHE_TTL', 24 * 60 * 60))
+
+    # Processes used to parse several uploaded documents at once. Every gunicorn
+    # worker spawns its own pool, so keep it small; 1 parses in the request thread
+    config['PARSE_WORKERS'] = int(os.environ.get('PARSE_WORKERS', 2))
+
+    # Background jobs: JOB_WORKERS running and JOB_QUEUE waiting per worker process,
+    # with state in a directory shared by all workers and removed after JOB_TTL seconds
+    config['JOBS_DIR'] = os.environ.get(
+        'JOBS_DIR', os.path.join(tempfile.gettempdir(), 'werscode-jobs'))
+    config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+    config['JOB_QUEUE'] = int(os.environ.get('JOB_QUEUE', 8))
+    config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 60 * 60))
+
+    # SQLite catalog of every code description seen, shared by all workers
+    config['CATALOG_PATH'] = os.environ.get('CATALOG_PATH', 'catalog.sqlite3')
+
+    # Counters and histograms of every worker are kept in METRICS_DIR and summed
+    # on /metrics (empty METRICS_DIR reports this process only)
+    config['METRICS_DIR'] = os.environ.get(
+        'METRICS_DIR', os.path.join(tempfile.gettempdir(), 'werscode-metrics'))
+
+    # Upload budgets: whole request body, each .docx as uploaded and once
+    # decompressed, and the compression ratio of any large part (zip bombs).
+    # Uploaded files above UPLOAD_SPOOL_BYTES are kept in temporary files.
+    config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 64 * 2 ** 20))
+    config['MAX_DOCUMENT_BYTES'] = int(os.environ.get('MAX_DOCUMENT_BYTES', 32 * 2 ** 20))
+    config['MAX_UNCOMPRESSED_BYTES'] = int(
+        os.environ.get('MAX_UNCOMPRESSED_BYTES', 256 * 2 ** 20))
+    config['MAX_COMPRESSION_RATIO'] = int(os.environ.get('MAX_COMPRESSION_RATIO', 200))
+    config['UPLOAD_SPOOL_BYTES'] = int(os.environ.get('UPLOAD_SPOOL_BYTES', 2 ** 20))
+
+# Rows per page of the results table
+RESULTS_PAGE_SIZE = 100
+
+# Occurrences listed per code and document in API responses
+OCCURRENCE_LIMIT = 5
+
+# Bump when the ParsedDocument contents change so old cache entries are ignored
+PARSED_DOCUMENT_VERSION = 4
+
+def init_services(config):
+    # The caches, stores, catalog, metrics and job runner every request uses.
+    # They are module-level so the CLI and the parse pool reach them too;
+    # nothing here touches the disk until it is first used.
+    global parse_cache, revision_cache, report_store, code_catalog, metrics, job_store, job_runner
+
+    # python-docx and streaming give the same results and share the cache;
+    # all-parts reads more of each document and keeps its results apart
+    variant = 'all-parts-' if config['EXTRACTION_ENGINE'] == 'all-parts' else ''
+    parse_cache = ParseCache(
+        os.path.join(config['PARSE_CACHE_DIR'], f'{variant}v{PARSED_DOCUMENT_VERSION}')
+        if config['PARSE_CACHE_DIR'] else None,
+        max_entries=config['PARSE_CACHE_SIZE'],
+        ttl=config['PARSE_CACHE_TTL'])
+
+    # Per-block extraction results of document revisions, for /api/delta
+    revision_cache = ParseCache(
+        os.path.join(config['PARSE_CACHE_DIR'], f'{variant}blocks-v{PARSED_DOCUMENT_VERSION}')
+        if config['PARSE_CACHE_DIR'] else None,
+        max_entries=config['PARSE_CACHE_SIZE'],
+        ttl=config['PARSE_CACHE_TTL'])
+
+    report_store = ReportStore(config['UPLOAD_FOLDER'], ttl=config['REPORT_TTL'])
+
+    code_catalog = CodeCatalog(config['CATALOG_PATH'])
+
+    metrics = Metrics(config['METRICS_DIR'] or None)
+    metrics.histogram('werscode_request_seconds', 'Time to handle a request, by endpoint')
+    metrics.histogram('werscode_stage_seconds', 'Time spent in each stage of a request')
+    metrics.counter('werscode_documents_parsed_total', 'Documents parsed (cache misses)')
+    metrics.counter('werscode_document_bytes_total', 'Bytes of uploaded documents')
+    metrics.counter('werscode_parse_cache_hits_total', 'Uploads answered from the parse cache')
+    metrics.counter('werscode_parse_cache_misses_total', 'Uploads that had to be parsed')
+    metrics.counter('werscode_codes_matched_total', 'Requested codes found in a document')
+    metrics.counter('werscode_documents_rejected_total', 'Uploads refused before parsing')
+    metrics.histogram('werscode_request_peak_rss_bytes',
+                      'Peak resident memory while handling a POST',
+                      buckets=[2 ** 20 * mb for mb in (64, 128, 256, 384, 512, 768, 1024, 2048)])
+
+    job_store = FileJobStore(config['JOBS_DIR'], ttl=config['JOB_TTL'])
+    job_runner = JobRunner(job_store, max_workers=config['JOB_WORKERS'],
+                           max_pending=config['JOB_QUEUE'])
+
+# Description rules for every paragraph, table row and cell, compiled once
+DESCRIPTION_RULES = RuleSet()
+
+# Uppercase 4-5 character tokens standing on their own, i.e. candidate codes
+CODE_TOKEN_PATTERN = re.compile(r'(?<![A-Za-z0-9])[A-Z0-9]{4,5}(?![A-Za-z0-9])')
+
+# Heading of each header, footer, note, comment and text box in the report
+PART_HEADINGS = {
+    'header': 'Header Section',
+    'footer': 'Footer Section',
+    'footnote': 'Footnote',
+    'endnote': 'Endnote',
+    'comment': 'Comment',
+    'textbox': 'Text Box',
+}
+
+class ParsedDocument:
+    # Everything the request needs from one .docx: the flattened text written to
+    # the report, the code -> description map, a count of every code token and
+    # where each token appears. It is filled by a single traversal so an
+    # upload is only parsed once.
+    # Blocks may arrive in document order (streaming engine) or grouped
+    # (python-docx engine); paragraphs, tables and headers/footers are kept
+    # apart so the text comes out the same, and description rules decide
+    # between candidates by precedence rather than by arrival order.
+    def __init__(self):
+        self.key = None
+        self.paragraph_lines = []
+        self.table_lines = []
+        self.part_lines = []
+        self.code_index = Counter()
+        self.occurrences = OccurrenceIndex()
+        self.descriptions = DESCRIPTION_RULES.collector()
+        self.codes_with_descriptions = {}
+        self._row_number = 0
+
+    @property
+    def lines(self):
+        return self.paragraph_lines + self.table_lines + self.part_lines
+
+    @property
+    def text(self):
+        return '\n'.join(self.lines)
+
+    @property
+    def lines_by_kind(self):
+        lines = dict.fromkeys(PART_HEADINGS, self.part_lines)
+        lines.update(paragraph=self.paragraph_lines, table=self.table_lines)
+        return lines
+
+    def _add_line(self, lines, kind, prefix, text, number):
+        # Only the text is scanned for codes, not the numbering prefix
+        line = len(lines)
+        positions = self.occurrences.positions
+        for match in CODE_TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            offset = match.start()
+            self.code_index[token] += 1
+            positions.setdefault(token, []).append(
+                [kind, line, len(prefix) + offset, offset, number])
+        lines.append(prefix + text)
+
+    def add_paragraph(self, number, para_text):
+        text = para_text.strip()
+        if not text:
+            return
+        self._add_line(self.paragraph_lines, 'paragraph', f"{number}. ", para_text, number)
+        self.descriptions.add('paragraph', text)
+
+    def add_table(self, number):
+        self.table_lines.append(f"\nTable {number}:")
+        self._row_number = 0
+
+    def add_row(self, table_number, row):
+        # row is a docx_stream.TableRow: merged cells repeat in row.texts but
+        # appear once in row.cells, so each cell's text is only matched against
+        # the description rules once. Tokens are found in the row's line in one
+        # pass; a merged cell's tokens count, and are located, in every column
+        # it spans.
+        self._row_number += 1
+        line = len(self.table_lines)
+        row_text = " | ".join(row.texts)
+        self.table_lines.append(row_text)
+        starts = None
+        positions = self.occurrences.positions
+        for match in CODE_TOKEN_PATTERN.finditer(row_text):
+            if starts is None:
+                starts = list(accumulate([len(text) + 3 for text in row.texts], initial=0))
+            token = match.group()
+            line_offset = match.start()
+            column = bisect_right(starts, line_offset)
+            self.code_index[token] += 1
+            positions.setdefault(token, []).append(
+                ['table', line, line_offset, line_offset - starts[column - 1],
+                 table_number, self._row_number, column])
+        if not row.texts:
+            return
+
+        # The full row text, then every cell once; a merged cell seen again
+        # could not change anything
+        self.descriptions.add('row', ' '.join(row.texts))
+        for cell_text in row.cells:
+            self.descriptions.add('cell', cell_text)
+
+    def add_part(self, kind, number, texts):
+        # A header or footer (numbered by section), or with the all-parts
+        # engine also a footnote, endnote, comment or text box
+        if any(text.strip() for text in texts):
+            self.part_lines.append(f"\n{PART_HEADINGS[kind]} {number}:")
+            for text in texts:
+                if text.strip():
+                    self._add_line(self.part_lines, kind, '', text, number)
+
+    def state(self):
+        # Plain data for the parse cache
+        return {
+            'paragraph_lines': self.paragraph_lines,
+            'table_lines': self.table_lines,
+            'part_lines': self.part_lines,
+            'code_index': self.code_index,
+            'occurrences': self.occurrences.positions,
+            'codes_with_descriptions': self.codes_with_descriptions,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        parsed = cls()
+        parsed.paragraph_lines = state['paragraph_lines']
+        parsed.table_lines = state['table_lines']
+        parsed.part_lines = state['part_lines']
+        parsed.code_index = Counter(state['code_index'])
+        parsed.occurrences = OccurrenceIndex(state['occurrences'])
+        parsed.codes_with_descriptions = state['codes_with_descriptions']
+        return parsed
+
+    def finish(self):
+        self.codes_with_descriptions = self.descriptions.descriptions()
+        return self
+
+def iter_docx_blocks(doc):
+    # Blocks from the python-docx object model: paragraphs, then tables row by
+    # row, then the header and footer of every section. Tables go through the
+    # same grid model as the streaming engine rather than row.cells, which
+    # rebuilds the whole table's cell list for every row.
+    import docx_stream
 
-    # Extract visible text from paragraphs with section numbers
     for i, para in enumerate(doc.paragraphs, 1):
-        if para.text.strip():  # Only add non-empty paragraphs
-            full_text.append(f"{i}. {para.text}")
+        yield 'paragraph', i, para.text
 
-    # Extract text from tables
     for table_num, table in enumerate(doc.tables, 1):
-        full_text.append(f"\nTable {table_num}:")
-        for row in table.rows:
-            row_text = []
-            for cell in row.cells:
-                row_text.append(cell.text.strip())
-            full_text.append(" | ".join(row_text))
-
-    # Extract text from headers and footers
+        yield 'table', table_num, None
+        grid = docx_stream.TableGrid(len(table.columns))
+        for tr in table._tbl.tr_lst:
+            for row in grid.add_row(tr):
+                yield 'row', table_num, row
+        for row in grid.finish():
+            yield 'row', table_num, row
+
     for section_num, section in enumerate(doc.sections, 1):
-        # Extract headers
-        header = section.header
-        if any(paragraph.text.strip() for paragraph in header.paragraphs):
-            full_text.append(f"\nHeader Section {section_num}:")
-            for paragraph in header.paragraphs:
-                if paragraph.text.strip():
-                    full_text.append(paragraph.text)
-
-        # Extract footers
-        footer = section.footer
-        if any(paragraph.text.strip() for paragraph in footer.paragraphs):
-            full_text.append(f"\nFooter Section {section_num}:")
-            for paragraph in footer.paragraphs:
-                if paragraph.text.strip():
-                    full_text.append(paragraph.text)
-
-    return '\n'.join(full_text)
+        yield 'header', section_num, [paragraph.text for paragraph in section.header.paragraphs]
+        yield 'footer', section_num, [paragraph.text for paragraph in section.footer.paragraphs]
 
-def extract_codes_from_text(text, codes):
-    codes_set = set(codes)
-    found_codes = set()
+# The parsing stack (python-docx, lxml) is imported by the first parse, not
+# when the app starts; warm_up() imports it ahead of the first request
+def python_docx_blocks(file):
+    from docx import Document
+    return iter_docx_blocks(Document(file))
 
-    # Match each code in the text
-    for code in codes_set:
-        if code in text:
-            found_codes.add(code)
+def streaming_blocks(file):
+    import docx_stream
+    return docx_stream.iter_blocks(file)
 
-    return found_codes
+def all_parts_blocks(file):
+    import docx_parts
+    return docx_parts.iter_blocks(file)
 
-def extract_codes_and_descriptions(doc):
-    codes_with_descriptions = {}
+EXTRACTION_ENGINES = {
+    'python-docx': python_docx_blocks,
+    'streaming': streaming_blocks,
+    'all-parts': all_parts_blocks,
+}
 
-    # First pass: Look for descriptions followed by codes in paragraphs and tables
-    for paragraph in doc.paragraphs:
-        text = paragraph.text.strip()
-        if not text:
-            continue
-
-        # Remove any "Note:" sections
-        text = re.sub(r'Note:.*$', '', text).strip()
-
-        # Look for description followed by code pattern
-        # Match text ending with a 4-5 character alphanumeric code
-        match = re.search(r'^(.*?)\s*([A-Z0-9]{4,5})$', text)
-        if match:
-            desc, code = match.groups()
-            desc = desc.strip(' -–')  # Remove leading/trailing dashes
-            if desc:
-                codes_with_descriptions[code] = desc
-
-    # Second pass: Look in tables
-    for table in doc.tables:
-        for row in table.rows:
-            if len(row.cells) < 1:
+def build_parsed_document(blocks):
+    parsed = ParsedDocument()
+    for kind, number, content in blocks:
+        if kind == 'paragraph':
+            parsed.add_paragraph(number, content)
+        elif kind == 'table':
+            parsed.add_table(number)
+        elif kind == 'row':
+            parsed.add_row(number, content)
+        else:
+            parsed.add_part(kind, number, content)
+    return parsed.finish()
+
+def parse_document(file):
+    engine = EXTRACTION_ENGINES[app.config['EXTRACTION_ENGINE']]
+    return build_parsed_document(engine(file))
+
+def load_revision(file, previous=None):
+    # Per-block results of one revision; blocks unchanged since the previous
+    # revision are not extracted again
+    key = content_key(file)
+    state = revision_cache.get(key)
+    if state is not None:
+        return Revision.from_state(key, state)
+    check_upload(file)
+    engine = EXTRACTION_ENGINES[app.config['EXTRACTION_ENGINE']]
+    with timed('parse'):
+        revision = extract_revision(engine(file), DESCRIPTION_RULES, CODE_TOKEN_PATTERN,
+                                    previous)
+    revision.key = key
+    revision_cache.put(key, revision.state())
+    return revision
+
+def load_document_lines(key):
+    # Extracted text lines of a previously loaded document, if still cached
+    state = parse_cache.get(key)
+    return ParsedDocument.from_state(state).lines if state is not None else None
+
+def parse_document_bytes(data, engine):
+    # Runs in a pool process: parse raw .docx bytes and return plain cacheable data
+    app.config['EXTRACTION_ENGINE'] = engine
+    return parse_document(io.BytesIO(data)).state()
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    # Spawned rather than forked: gunicorn's gthread workers already run threads
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=app.config['PARSE_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'))
+        return _parse_pool
+
+@contextmanager
+def timed(stage):
+    # Time a stage of the request for /metrics and the Server-Timing header
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('werscode_stage_seconds', elapsed, stage=stage)
+        if has_request_context():
+            timings = g.setdefault('stage_timings', {})
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def publish_metrics():
+    # Metrics are best effort; never fail the request over them
+    try:
+        metrics.flush()
+    except OSError:
+        app.logger.exception('Could not write metrics')
+
+def check_upload(file, name=None):
+    # Refuse an upload over the size budgets before any of it is parsed
+    try:
+        check_document(file, name or document_name(file), app.config['MAX_DOCUMENT_BYTES'],
+                       app.config['MAX_UNCOMPRESSED_BYTES'], app.config['MAX_COMPRESSION_RATIO'])
+    except DocumentRejected:
+        metrics.inc('werscode_documents_rejected_total')
+        raise
+
+def reset_peak_memory():
+    # Linux lets a process reset its peak RSS (VmHWM); elsewhere the peak
+    # stays the process-wide maximum. Threads of one worker share the figure.
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_memory():
+    # Peak resident set size in bytes, or None where it cannot be read
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def upload_size(file):
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+def record_in_catalog(parsed, source):
+    # The catalog is a convenience; never fail the request over it
+    try:
+        with timed('catalog'):
+            code_catalog.record(parsed.codes_with_descriptions, source)
+    except sqlite3.Error:
+        app.logger.exception('Could not update the code catalog')
+
+def document_name(file):
+    # Upload filename, or path when run from the command line
+    return getattr(file, 'filename', None) or getattr(file, 'name', None) or str(file)
+
+def iter_documents(files, names=None):
+    # Yield (index, parsed, error) for each upload as soon as it is available:
+    # cached documents first, then cache misses as they finish. With more than
+    # one miss they are parsed concurrently in the process pool, keeping at
+    # most two documents per pool process in flight. names are what the
+    # catalog and error messages call the documents, when files are copies
+    # (a background job's) rather than the uploads themselves.
+    names = names or [document_name(file) for file in files]
+    with timed('hash'):
+        keys = [content_key(file) for file in files]
+        metrics.inc('werscode_document_bytes_total', sum(upload_size(file) for file in files))
+    missing = []
+    for i, key in enumerate(keys):
+        with timed('cache'):
+            state = parse_cache.get(key)
+        if state is not None:
+            metrics.inc('werscode_parse_cache_hits_total')
+            parsed = ParsedDocument.from_state(state)
+            parsed.key = key
+            record_in_catalog(parsed, names[i])
+            yield i, parsed, None
+        else:
+            missing.append(i)
+    if missing:
+        metrics.inc('werscode_parse_cache_misses_total', len(missing))
+
+    # Check every upload that needs parsing before parsing any of them
+    accepted = []
+    for i in missing:
+        try:
+            check_upload(files[i], names[i])
+        except DocumentRejected as exc:
+            yield i, None, exc
+        else:
+            accepted.append(i)
+    missing = accepted
+
+    if len(missing) > 1 and app.config['PARSE_WORKERS'] > 1:
+        pool = get_parse_pool()
+        queue = iter(missing)
+        futures = {}
+        while True:
+            while len(futures) < 2 * app.config['PARSE_WORKERS']:
+                i = next(queue, None)
+                if i is None:
+                    break
+                futures[pool.submit(parse_document_bytes, files[i].read(),
+                                    app.config['EXTRACTION_ENGINE'])] = i
+            if not futures:
+                break
+            with timed('parse'):
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = futures.pop(future)
+                try:
+                    state = future.result()
+                except Exception as exc:
+                    yield i, None, exc
+                    continue
+                metrics.inc('werscode_documents_parsed_total')
+                parse_cache.put(keys[i], state)
+                parsed = ParsedDocument.from_state(state)
+                parsed.key = keys[i]
+                record_in_catalog(parsed, names[i])
+                yield i, parsed, None
+    else:
+        for i in missing:
+            try:
+                with timed('parse'):
+                    parsed = parse_document(files[i])
+            except Exception as exc:
+                yield i, None, exc
                 continue
+            metrics.inc('werscode_documents_parsed_total')
+            parse_cache.put(keys[i], parsed.state())
+            parsed.key = keys[i]
+            record_in_catalog(parsed, names[i])
+            yield i, parsed, None
+
+def load_documents(files, progress=None, names=None):
+    # Parse the uploads, or reuse the results for identical bytes seen before,
+    # in upload order. progress(done, total) is called as each document
+    # becomes available.
+    documents = [None] * len(files)
+    for done, (i, parsed, error) in enumerate(iter_documents(files, names), 1):
+        if error is not None:
+            raise error
+        documents[i] = parsed
+        if progress:
+            progress(done, len(files))
+    return documents
+
+def extract_text_from_docx(file):
+    return parse_document(file).text
+
+def extract_codes_from_text(text, codes):
+    # Codes that appear in the text as whole tokens
+    return CodeMatcher(codes).find(text)
+
+def extract_codes_and_descriptions(doc):
+    return build_parsed_document(iter_docx_blocks(doc)).codes_with_descriptions
+
+def calculate_time_metrics(code_results):
+    # Calculate time metrics for CFD completion (excluding VOCI-only codes)
+    # Filter out VOCI-only codes
+    wers_codes = [code for code, result in code_results if 'VOCI Only' not in result['source']]
+
+    # Always add 1 day buffer time for entity and MPV$ codes
+    entity_mpv_codes = [code for code in wers_codes if 'ENTITY' in code.upper() or 'MPV$' in code.upper()]
+    buffer_days = 1  # Always add 1 day buffer for entity/MPV$ codes
+
+    total_codes = len(wers_codes)
+    total_minutes = total_codes * 4  # Each code takes 4 minutes
+    total_hours = total_minutes / 60
+    total_days = (total_hours / 8) + buffer_days  # Assuming 8 working hours per day + buffer
+
+    # Calculate base days without buffer
+    base_days = total_hours / 8
 
-            # Get full row text
-            row_text = ' '.join(cell.text.strip() for cell in row.cells)
-            row_text = re.sub(r'Note:.*$', '', row_text).strip()
-
-            # Look for description followed by code pattern
-            match = re.search(r'^(.*?)\s*([A-Z0-9]{4,5})$', row_text)
-            if match:
-                desc, code = match.groups()
-                desc = desc.strip(' -–')
-                if desc:
-                    codes_with_descriptions[code] = desc
-
-            # Also check individual cells for the pattern
-            for cell in row.cells:
-                cell_text = cell.text.strip()
-                match = re.search(r'^(.*?)\s*([A-Z0-9]{4,5})$', cell_text)
-                if match:
-                    desc, code = match.groups()
-                    desc = desc.strip(' -–')
-                    if desc and code not in codes_with_descriptions:
-                        codes_with_descriptions[code] = desc
-
-    return codes_with_descriptions
-
-@app.route('/', methods=['GET', 'POST'])
+    return {
+        'total_codes': total_codes,
+        'total_minutes': total_minutes,
+        'total_hours': round(total_hours, 2),
+        'base_days': round(base_days, 2),
+        'buffer_days': buffer_days,
+        'total_days': round(total_days, 2),
+        'has_entity_mpv': len(entity_mpv_codes) > 0
+    }
+
+def parse_code_list(text):
+    # Five character WERS/VOCI codes in order of appearance
+    return re.findall(r'[A-Z0-9]{5}', text)
+
+def form_code_lists(fields=('input_codes', 'voci_codes')):
+    # One code list per form field. A file uploaded as '<field>_file' (text or
+    # CSV) takes the place of the pasted text and is read as a stream; the
+    # summary gives its unique, duplicate and invalid line counts.
+    lists = []
+    summary = {}
+    for field in fields:
+        upload = request.files.get(f'{field}_file')
+        if upload:
+            with timed('code_lists'):
+                code_list = read_code_list(upload.stream)
+            summary[field] = {'codes': len(code_list.codes),
+                              'duplicates': code_list.duplicates,
+                              'invalid': code_list.invalid}
+            lists.append(code_list.codes)
+        else:
+            lists.append(parse_code_list(request.form.get(field, '')))
+    return lists, summary
+
+def near_match_mode():
+    # The optional near-match mode is asked for with a 'near_matches' form field
+    return request.form.get('near_matches', '') not in ('', '0', 'false')
+
+def near_match_records(documents, input_codes_list, voci_codes_list):
+    # Codes found in none of the documents, each with the document tokens one
+    # edit away from it (a typo or OCR slip in the pasted list), in list order
+    code_indexes = [document.code_index for document in documents]
+    asked = list(dict.fromkeys(input_codes_list + voci_codes_list))
+    missing = [code for code in asked if not any(code in index for index in code_indexes)]
+    suggestions = suggest_near_matches(missing, code_indexes, exclude=asked)
+    voci = set(voci_codes_list)
+    return [{'code': code, 'in_voci': code in voci, 'suggestions': suggestions[code]}
+            for code in missing if code in suggestions]
+
+def catalog_descriptions(descriptions, input_codes_list, voci_codes_list):
+    # Codes the documents do not describe fall back to the catalog
+    missing = (set(input_codes_list) | set(voci_codes_list)) - descriptions.keys()
+    if missing:
+        try:
+            descriptions.update(code_catalog.lookup(missing))
+        except sqlite3.Error:
+            app.logger.exception('Could not read the code catalog')
+    return descriptions
+
+def analyze_parsed(documents, input_codes_list, voci_codes_list, matcher=None,
+                   near_matches=False):
+    # Match and classify the codes against already parsed documents.
+    # Descriptions come from the first document, as on the upload page,
+    # then from the code catalog. With near_matches, codes the documents do
+    # not contain get suggestions of tokens that nearly match them.
+    # Build the matcher once and look the codes up in each document's token index
+    matcher = matcher or CodeMatcher(input_codes_list)
+    document_hits = [matcher.count_index(document.code_index) for document in documents]
+
+    descriptions = catalog_descriptions(dict(documents[0].codes_with_descriptions),
+                                        input_codes_list, voci_codes_list)
+
+    # Classify every code by its VOCI/document membership
+    code_results = compare_codes(document_hits, input_codes_list, voci_codes_list,
+                                 descriptions)
+    metrics.inc('werscode_codes_matched_total',
+                sum(1 for code, result in code_results if result['hits']))
+
+    analysis = {
+        'code_results': code_results,
+        'time_metrics': calculate_time_metrics(code_results),
+        'categories': index_categories(code_results),
+        'documents': [document.key for document in documents]
+    }
+    if near_matches:
+        analysis['near_matches'] = near_match_records(documents, input_codes_list,
+                                                      voci_codes_list)
+    return analysis
+
+def analyze_documents(files, input_codes_list, voci_codes_list, progress=None,
+                      code_lists=None, near_matches=False, names=None):
+    # Everything upload_file() does short of saving the report and rendering.
+    # progress(stage, percent) is called as the work advances; code_lists is
+    # the summary of uploaded code list files, kept with the results; names
+    # are passed on to iter_documents().
+    # Returns the analysis and the parsed documents, which the analysis only
+    # names by their cache keys.
+    progress = progress or (lambda stage, percent: None)
+
+    # Parse the documents once each (or fetch them from the cache): text,
+    # descriptions and code index together. Several uploads are parsed in parallel.
+    progress('parsing', 0)
+    documents = load_documents(
+        files, progress=lambda done, total: progress('parsing', int(80 * done / total)),
+        names=names)
+
+    progress('matching', 80)
+
+    with timed('match'):
+        analysis = analyze_parsed(documents, input_codes_list, voci_codes_list,
+                                  near_matches=near_matches)
+    analysis['code_lists'] = code_lists or {}
+    return analysis, documents
+
+def save_report(analysis):
+    # Keep what the report needs under a new id; the report itself is only
+    # generated when downloaded. A failure here must not fail the page.
+    report_id = report_store.new_id()
+    try:
+        with timed('report'):
+            report_store.save(report_id, analysis)
+    except OSError:
+        app.logger.exception('Could not save report manifest')
+    return report_id
+
+def render_results(analysis, report_id):
+    # The results page embeds only the first page of rows and the per-category
+    # counts; further pages come from api_results() as the table scrolls
+    code_results = analysis['code_results']
+    categories = analysis['categories']
+    with timed('render'):
+        return render_template('display.html',
+                               file_txt_url=url_for('.download_file', filename=f'{report_id}.txt'),
+                               export_urls=export_urls(report_id),
+                               results_url=url_for('.api_results', report_id=report_id),
+                               occurrences_url=url_for('.api_occurrences', report_id=report_id,
+                                                       code='CODE'),
+                               category_counts=category_counts(code_results, categories),
+                               initial_page=results_page(code_results, categories, 'all', 0,
+                                                         RESULTS_PAGE_SIZE),
+                               page_size=RESULTS_PAGE_SIZE,
+                               time_metrics=analysis['time_metrics'],
+                               code_lists=analysis.get('code_lists', {}),
+                               near_matches=analysis.get('near_matches'))
+
+# Every page and API route; create_app() registers them on the application
+views = Blueprint('werscode', __name__)
+
+@views.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if request.method == 'POST':
+        reset_peak_memory()
+
+@views.after_app_request
+def record_request_timing(response):
+    # Stage timings in milliseconds for the browser's network panel
+    timings = g.get('stage_timings', {})
+    entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()]
+    elapsed = time.perf_counter() - g.request_started
+    entries.append(f'total;dur={elapsed * 1000:.1f}')
+    response.headers['Server-Timing'] = ', '.join(entries)
+    # Health checks poll all day; keep them out of the metrics and off the disk
+    if request.endpoint == 'werscode.health':
+        return response
+    metrics.observe('werscode_request_seconds', elapsed, endpoint=request.endpoint or 'none')
+    if request.method == 'POST':
+        peak = peak_memory()
+        if peak is not None:
+            metrics.observe('werscode_request_peak_rss_bytes', peak)
+            app.logger.info('%s %s: peak RSS %.1f MB, %.0f ms', request.method, request.path,
+                            peak / 2 ** 20, elapsed * 1000)
+    publish_metrics()
+    return response
+
+def upload_error(message, status):
+    # JSON for the API and background jobs, the form page with the error otherwise
+    if request.path.startswith(('/api/', '/jobs')):
+        return jsonify(error=message), status
+    template = ('comparison_results.html' if request.endpoint == 'werscode.compare_documents'
+                else 'upload.html')
+    return render_template(template, error=message), status
+
+@views.app_errorhandler(DocumentRejected)
+def document_rejected(exc):
+    return upload_error(str(exc), exc.status)
+
+@views.app_errorhandler(413)
+def request_too_large(exc):
+    limit = current_app.config['MAX_CONTENT_LENGTH'] / 2 ** 20
+    return upload_error(f'The upload is larger than the {limit:.0f} MB limit', 413)
+
+@views.route('/', methods=['GET', 'POST'])
 def upload_file():
     if request.method == 'POST':
         file = request.files.get('file')
         file2 = request.files.get('file2')
-        input_codes = request.form.get('input_codes', '')
-        voci_codes_text = request.form.get('voci_codes', '')
 
         if file:
-            # Load the document
-            doc = Document(file)
-
-            # Extract descriptions first
-            codes_with_descriptions = extract_codes_and_descriptions(doc)
-
-            # Convert DOCX to text for code matching
-            text = extract_text_from_docx(file)
-
-            # Parse input WERS codes from newline-separated input while preserving order
-            input_codes_list = [code for code in re.findall(r'[A-Z0-9]{5}', input_codes)]
-
-            # Parse VOCI codes from pasted text
-            voci_codes_list = re.findall(r'[A-Z0-9]{5}', voci_codes_text)
-
-            # Extract codes found in Word document 1
-            found_codes_doc1 = extract_codes_from_text(text, input_codes_list)
-
-            found_codes_doc2 = set()
-            if file2:
-                # Extract text from second document
-                text2 = extract_text_from_docx(file2)
-                found_codes_doc2 = extract_codes_from_text(text2, input_codes_list)
-
-            # Determine which codes are from VOCI alone
-            voci_alone_codes = set(voci_codes_list) - found_codes_doc1 - found_codes_doc2
-
-            # Determine codes common to both VOCI and Word documents
-            common_voci_and_doc1 = set(voci_codes_list).intersection(found_codes_doc1)
-            common_voci_and_doc2 = set(voci_codes_list).intersection(found_codes_doc2)
-
-            # Combine all found codes for display
-            combined_codes = found_codes_doc1.union(found_codes_doc2)
-
-            # Modify the code_results creation to include descriptions
-            code_results = []
-            for code in input_codes_list:
-                if code in voci_alone_codes:
-                    source = 'VOCI Only'
-                elif code in common_voci_and_doc1 and code in common_voci_and_doc2:
-                    source = 'Both VOCI and WERS Document 1 and 2'
-                elif code in common_voci_and_doc1:
-                    source = 'Both VOCI and WERS Document 1'
-                elif code in common_voci_and_doc2:
-                    source = 'Both VOCI and WERS Document 2'
-                elif code in found_codes_doc1:
-                    source = 'WERS Document 1 Only'
-                elif code in found_codes_doc2:
-                    source = 'WERS Document 2 Only'
-                else:
-                    continue
+            (input_codes_list, voci_codes_list), code_lists = form_code_lists()
+            analysis, _ = analyze_documents([file, file2] if file2 else [file],
+                                            input_codes_list, voci_codes_list,
+                                            code_lists=code_lists,
+                                            near_matches=near_match_mode())
 
-                result_dict = {
-                    'source': source,
-                    'description': codes_with_descriptions.get(code, '')
-                }
-                code_results.append((code, result_dict))
-
-            # Add VOCI-only codes with their descriptions
-            for code in voci_codes_list:
-                if code not in input_codes_list:
-                    result_dict = {
-                        'source': 'VOCI Only',
-                        'description': codes_with_descriptions.get(code, '')
-                    }
-                    code_results.append((code, result_dict))
-
-            # Save text file with extracted text and results
-            text_file_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file.txt')
-
-            # Calculate time metrics for CFD completion (excluding VOCI-only codes)
-            # Filter out VOCI-only codes
-            wers_codes = [code for code, result in code_results if 'VOCI Only' not in result['source']]
-
-            # Always add 1 day buffer time for entity and MPV$ codes
-            entity_mpv_codes = [code for code in wers_codes if 'ENTITY' in code.upper() or 'MPV$' in code.upper()]
-            buffer_days = 1  # Always add 1 day buffer for entity/MPV$ codes
-
-            total_codes = len(wers_codes)
-            total_minutes = total_codes * 4  # Each code takes 4 minutes
-            total_hours = total_minutes / 60
-            total_days = (total_hours / 8) + buffer_days  # Assuming 8 working hours per day + buffer
-
-            with open(text_file_path, 'w', encoding='utf-8') as f:
-                f.write("WERS Code Analysis Results\n")
-                f.write("=========================\n\n")
-
-                # Write time metrics
-                f.write("CFD Completion Time Estimate (WERS Codes Only):\n")
-                f.write("-----------------------------------------\n")
-                f.write(f"Total WERS Codes (excluding VOCI-only): {total_codes}\n")
-                f.write(f"Total Minutes (4 mins per code): {total_minutes}\n")
-                f.write(f"Total Hours: {round(total_hours, 2)}\n")
-                f.write(f"Total Working Days (8hrs/day + 1 day buffer): {round(total_days, 2)}\n")
-                f.write(f"Note: 1 day buffer is added for entity and MPV$ codes\n\n")
-
-                # Write Document 1 content
-                f.write("Extracted Text from Document 1:\n")
-                f.write("--------------------------\n")
-                f.write(text)
-                f.write("\n\n")
-
-                # Write Document 2 content if it exists
-                if file2:
-                    f.write("Extracted Text from Document 2:\n")
-                    f.write("--------------------------\n")
-                    f.write(text2)
-                    f.write("\n\n")
-
-                # Write analysis results
-                f.write("Analysis Results:\n")
-                f.write("----------------\n")
-                for code, result in code_results:
-                    f.write(f"{code}: {result['source']} - {result['description']}\n")
-
-            # Calculate base days without buffer
-            base_days = total_hours / 8
-
-            return render_template('display.html',
-                                   code_results=code_results,
-                                   file_txt_url=url_for('download_file', filename='file.txt'),
-                                   time_metrics={
-                                       'total_codes': total_codes,
-                                       'total_minutes': total_minutes,
-                                       'total_hours': round(total_hours, 2),
-                                       'base_days': round(base_days, 2),
-                                       'buffer_days': buffer_days,
-                                       'total_days': round(total_days, 2),
-                                       'has_entity_mpv': len(entity_mpv_codes) > 0
-                                   })
+            # Each request gets its own report, generated when it is downloaded
+            report_id = save_report(analysis)
+
+            return render_results(analysis, report_id)
 
     return render_template('upload.html')
 
-@app.route('/uploads/<filename>')
+@views.route('/jobs', methods=['POST'])
+def submit_job():
+    # Same form as upload_file(), processed in the background; returns a job id at once
+    files = [file for file in (request.files.get('file'), request.files.get('file2')) if file]
+    if not files:
+        return jsonify(error='No document uploaded'), 400
+
+    # Refuse oversized documents now rather than in the background
+    for file in files:
+        check_upload(file)
+
+    # Code list files are read now too; only the codes go to the job
+    (input_codes_list, voci_codes_list), code_lists = form_code_lists()
+    near_matches = near_match_mode()
+
+    job_store.sweep()
+    job_id = job_store.create()
+
+    # The request's upload streams close when it returns, so keep copies with the job
+    names = [file.filename for file in files]
+    paths = []
+    for number, file in enumerate(files, 1):
+        path = job_store.path(job_id, f'document-{number}.docx')
+        file.save(path)
+        paths.append(path)
+
+    def work(progress):
+        handles = [open(path, 'rb') for path in paths]
+        try:
+            analysis, _ = analyze_documents(handles, input_codes_list, voci_codes_list,
+                                            progress, code_lists, near_matches, names)
+        finally:
+            for handle in handles:
+                handle.close()
+        result = {'analysis': analysis, 'report_id': save_report(analysis), 'documents': names}
+        # Jobs run outside a request, so publish their metrics here
+        publish_metrics()
+        return result
+
+    try:
+        job_runner.submit(job_id, work)
+    except JobQueueFull:
+        job_store.update(job_id, state='failed', stage='rejected', error='Too many jobs queued')
+        return jsonify(error='Too many jobs queued, try again later'), 503
+
+    return jsonify(job_id=job_id,
+                   status_url=url_for('.job_status', job_id=job_id),
+                   result_url=url_for('.job_result', job_id=job_id),
+                   result_json_url=url_for('.job_result_json', job_id=job_id)), 202
+
+@views.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = job_store.get(job_id)
+    if status is None:
+        return jsonify(error='Unknown job'), 404
+    return jsonify(status)
+
+@views.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    status = job_store.get(job_id)
+    if status is None:
+        abort(404)
+    if status['state'] != 'done':
+        return jsonify(status), 409
+    # A finished job's result may have been swept since, or be unreadable
+    result = job_store.load_result(job_id)
+    if result is None:
+        abort(404)
+    return render_results(result['analysis'], result['report_id'])
+
+@views.route('/jobs/<job_id>/result.json')
+def job_result_json(job_id):
+    # JSON form of job_result(), with the same fields as api_extract()
+    status = job_store.get(job_id)
+    if status is None:
+        return jsonify(error='Unknown job'), 404
+    if status['state'] != 'done':
+        return jsonify(status), 409
+    result = job_store.load_result(job_id)
+    if result is None:
+        return jsonify(error='Job result is no longer available'), 404
+    analysis = result['analysis']
+    report_id = result['report_id']
+    return jsonify(documents=result.get('documents', []),
+                   codes=code_records(analysis['code_results'],
+                                      cached_documents(analysis['documents'])),
+                   time_metrics=analysis['time_metrics'],
+                   code_lists=analysis.get('code_lists', {}),
+                   near_matches=analysis.get('near_matches', []),
+                   report_url=url_for('.download_file', filename=f'{report_id}.txt'),
+                   exports=export_urls(report_id))
+
+@views.route('/compare', methods=['GET', 'POST'])
+def compare_documents():
+    if request.method == 'POST':
+        files = [file for file in request.files.getlist('files') if file]
+
+        if files:
+            (input_codes_list, voci_codes_list), code_lists = form_code_lists()
+            documents = load_documents(files)
+
+            # Earlier documents take precedence for descriptions
+            descriptions = {}
+            for document in reversed(documents):
+                descriptions.update(document.codes_with_descriptions)
+            descriptions = catalog_descriptions(descriptions, input_codes_list, voci_codes_list)
+
+            matcher = CodeMatcher(input_codes_list)
+            document_hits = [matcher.count_index(document.code_index) for document in documents]
+            code_results = compare_codes(document_hits, input_codes_list, voci_codes_list,
+                                         descriptions)
+            near_matches = None
+            if near_match_mode():
+                near_matches = near_match_records(documents, input_codes_list, voci_codes_list)
+
+            return render_template('comparison_results.html',
+                                   document_names=[file.filename for file in files],
+                                   code_results=code_results,
+                                   code_lists=code_lists,
+                                   near_matches=near_matches)
+
+    return render_template('comparison_results.html')
+
+def occurrence_records(documents, code, limit=OCCURRENCE_LIMIT):
+    # Where code appears in each parsed document, with context, from the
+    # index built while parsing
+    records = []
+    for number, document in enumerate(documents, 1):
+        for record in document.occurrences.records(code, document.lines_by_kind, limit):
+            records.append(dict(record, document=number))
+    return records
+
+def cached_documents(keys):
+    # Parsed documents of an earlier request, as far as they are still cached
+    states = [parse_cache.get(key) for key in keys]
+    return [ParsedDocument.from_state(state) if state is not None else ParsedDocument()
+            for state in states]
+
+def code_records(code_results, documents=None):
+    # API form of code_results: one flat record per code, listing where the
+    # code appears, and in which parts of the documents, when the parsed
+    # documents are given
+    records = [dict(result, code=code) for code, result in code_results]
+    if documents is not None:
+        for record in records:
+            if record['hits']:
+                record['occurrences'] = occurrence_records(documents, record['code'])
+                record['parts'] = sorted({part for document in documents
+                                          for part in document.occurrences.parts(record['code'])})
+            else:
+                record['occurrences'] = []
+                record['parts'] = []
+    return records
+
+@views.route('/api/extract', methods=['POST'])
+def api_extract():
+    # JSON version of upload_file(): documents in 'file' (and optionally 'file2')
+    # or any number in 'files', codes in 'input_codes' and 'voci_codes'
+    files = [file for file in (request.files.get('file'), request.files.get('file2')) if file]
+    files += [file for file in request.files.getlist('files') if file]
+    if not files:
+        return jsonify(error='No document uploaded'), 400
+
+    (input_codes_list, voci_codes_list), code_lists = form_code_lists()
+    analysis, documents = analyze_documents(files, input_codes_list, voci_codes_list,
+                                            code_lists=code_lists,
+                                            near_matches=near_match_mode())
+    report_id = save_report(analysis)
+    return jsonify(documents=[file.filename for file in files],
+                   codes=code_records(analysis['code_results'], documents),
+                   time_metrics=analysis['time_metrics'],
+                   code_lists=code_lists,
+                   near_matches=analysis.get('near_matches', []),
+                   report_url=url_for('.download_file', filename=f'{report_id}.txt'),
+                   exports=export_urls(report_id))
+
+@views.route('/api/extract/batch', methods=['POST'])
+def api_extract_batch():
+    # Each document in 'files' is analysed on its own against the same code
+    # lists; one NDJSON record is streamed per document as soon as it is done
+    files = [file for file in request.files.getlist('files') if file]
+    if not files:
+        return jsonify(error='No document uploaded'), 400
+    # Code list summaries are not repeated in every record
+    (input_codes_list, voci_codes_list), _ = form_code_lists()
+    matcher = CodeMatcher(input_codes_list)
+    near_matches = near_match_mode()
+
+    def generate():
+        for i, parsed, error in iter_documents(files):
+            record = {'index': i, 'document': files[i].filename}
+            if error is not None:
+                record['error'] = str(error)
+            else:
+                analysis = analyze_parsed([parsed], input_codes_list, voci_codes_list, matcher,
+                                          near_matches)
+                record['codes'] = code_records(analysis['code_results'], [parsed])
+                record['time_metrics'] = analysis['time_metrics']
+                if near_matches:
+                    record['near_matches'] = analysis['near_matches']
+            yield json.dumps(record) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@views.route('/api/delta', methods=['POST'])
+def api_delta():
+    # Codes added, removed and changed between two revisions of a document.
+    # The previous revision is uploaded as 'previous', or named by the
+    # 'previous_key' returned for it earlier; the new one is 'current'.
+    current_file = request.files.get('current')
+    previous_file = request.files.get('previous')
+    previous_key = request.form.get('previous_key', '')
+    if not current_file or not (previous_file or previous_key):
+        return jsonify(error='Upload current and previous documents, or give previous_key'), 400
+
+    if previous_file:
+        previous = load_revision(previous_file)
+    else:
+        state = revision_cache.get(previous_key) if previous_key.isalnum() else None
+        if state is None:
+            return jsonify(error='Unknown or expired previous_key; upload the document'), 404
+        previous = Revision.from_state(previous_key, state)
+    current = load_revision(current_file, previous)
+
+    (input_codes_list,), code_lists = form_code_lists(('input_codes',))
+    matcher = CodeMatcher(input_codes_list) if input_codes_list else None
+    with timed('match'):
+        delta = revision_delta(previous, current, DESCRIPTION_RULES, matcher)
+    return jsonify(previous_key=previous.key, current_key=current.key, code_lists=code_lists,
+                   blocks={'total': len(current.blocks), 'extracted': current.extracted,
+                           'reused': current.reused, 'cached': current.cached},
+                   **delta)
+
+@views.route('/api/codes')
+def api_search_codes():
+    # Prefix search over the code catalog; no document is parsed
+    prefix = request.args.get('prefix', '').strip().upper()
+    limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+    return jsonify(codes=code_catalog.search(prefix, limit))
+
+@views.route('/api/results/<report_id>')
+def api_results(report_id):
+    # One page of a request's results, optionally filtered by source category
+    manifest = report_store.load(report_id)
+    if manifest is None:
+        return jsonify(error='Unknown or expired results'), 404
+    category = request.args.get('category', 'all')
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', RESULTS_PAGE_SIZE, type=int), 1), 500)
+    return jsonify(results_page(manifest['code_results'], manifest['categories'],
+                                category, offset, limit))
+
+def export_urls(report_id):
+    return {extension: url_for('.download_file', filename=f'{report_id}.{extension}')
+            for extension in EXPORT_MIMETYPES}
+
+@views.route('/api/results/<report_id>/<code>/occurrences')
+def api_occurrences(report_id, code):
+    # Every place a code appears in a request's documents, with context
+    manifest = report_store.load(report_id)
+    if manifest is None:
+        return jsonify(error='Unknown or expired results'), 404
+    limit = request.args.get('limit', type=int)
+    documents = cached_documents(manifest['documents'])
+    return jsonify(code=code, occurrences=occurrence_records(documents, code, limit))
+
+@views.route('/uploads/<filename>')
 def download_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    # Exports are generated from the request's manifest on the first download
+    # and streamed in chunks; later downloads are served from the saved copy
+    report_id, extension = os.path.splitext(filename)
+    extension = extension[1:]
+    manifest = report_store.load(report_id) if extension in EXPORT_MIMETYPES else None
+    if manifest is None:
+        abort(404)
+    mimetype = EXPORT_MIMETYPES[extension]
+    path = report_store.artifact(report_id, extension)
+    if path is not None:
+        return send_file(path, mimetype=mimetype, as_attachment=True, download_name=filename)
+    chunks = report_store.cache_artifact(report_id, extension,
+                                         iter_export(extension, manifest, load_document_lines))
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@views.route('/metrics')
+def metrics_page():
+    # Prometheus text format, summed over all workers
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
-@app.route('/process', methods=['POST'])
+@views.route('/healthz')
+def health():
+    # For the platform's health checks: answers without loading the parser
+    # or touching any store
+    return jsonify(status='ok')
+
+@views.route('/process', methods=['POST'])
 def process():
     # This route is a placeholder and may need to be implemented fully
     # Currently the main functionality is in the upload_file route
@@ -261,5 +1070,37 @@ def process():
     # If this route is used, we should implement the time metrics calculation here too
     return render_template('upload.html')
 
+def warm_up(app):
+    # Do ahead of time what would otherwise slow down the first requests:
+    # import the parsing stack and run both engines over python-docx's own
+    # blank template, load numpy for the code sets and compile every
+    # template. gunicorn calls this in the master when it preloads the app,
+    # so forked workers share all of it copy-on-write.
+    import docx
+    blank = os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')
+    for engine in EXTRACTION_ENGINES.values():
+        build_parsed_document(engine(blank))
+    compare_codes([Counter(['CJTAB'])], ['CJTAB'], ['CJTAB'], {})
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def create_app(config=None):
+    # Application factory: settings from the environment, overridden by
+    # config, then the services and routes. The services are module-level,
+    # so the app created last in a process is the one they serve.
+    global app
+    app = Flask(__name__)
+    app.request_class = SpoolingRequest
+    # Per-request peak memory and similar notes are logged at INFO
+    app.logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+    load_config(app.config)
+    app.config.update(config or {})
+    init_services(app.config)
+    app.register_blueprint(views)
+    return app
+
+# The application gunicorn serves (app:app) and the CLI uses
+app = create_app()
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,40 @@
+import json
+import os
+import tempfile
+
+# Files shared by the gunicorn workers (cached parses, job state, report
+# manifests and exports, metrics) are written to a temporary file in the
+# same directory and renamed into place, so a reader in another process sees
+# the old file or the whole new one, never half of it. The temporary file is
+# removed if anything fails before the rename.
+
+def atomic_write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+def atomic_write_chunks(path, chunks):
+    # Pass the chunks through while writing them; the file appears at path
+    # once the last one has gone through
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Including a consumer that stops early (GeneratorExit)
+        _discard(tmp_path)
+        raise
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
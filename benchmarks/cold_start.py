@@ -0,0 +1,134 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+# Cold start of the app under gunicorn: time from launching the server to its
+# first answer, then the first page and the first document upload it serves,
+# which pay for anything still loaded lazily, and an upload of a second
+# document for comparison. Every run starts gunicorn afresh with empty
+# caches, so no parse result is served from the cache.
+#
+#   python -m benchmarks.cold_start --runs 5
+#   python -m benchmarks.cold_start --app-dir ../old-checkout --path / -o before.json
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.synthetic import generate
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = []
+    for name, value in fields.items():
+        body.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                    f'{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        body.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                    f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+                    .encode() + data + b'\r\n')
+    body.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(body), f'multipart/form-data; boundary={boundary}'
+
+def timed_request(url, data=None, content_type=None):
+    request = urllib.request.Request(url, data=data)
+    if content_type:
+        request.add_header('Content-Type', content_type)
+    started = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - started
+
+def cold_start(app_dir, path, documents, input_codes, workers, timeout):
+    work_dir = tempfile.mkdtemp(prefix='werscode-cold-')
+    port = free_port()
+    env = dict(os.environ,
+               PARSE_CACHE_DIR=os.path.join(work_dir, 'cache'),
+               JOBS_DIR=os.path.join(work_dir, 'jobs'),
+               METRICS_DIR=os.path.join(work_dir, 'metrics'),
+               UPLOAD_FOLDER=os.path.join(work_dir, 'uploads'),
+               CATALOG_PATH=os.path.join(work_dir, 'catalog.sqlite3'),
+               LOG_LEVEL='WARNING')
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn_config.py',
+               '-b', f'127.0.0.1:{port}', '--workers', str(workers)]
+    base = f'http://127.0.0.1:{port}'
+
+    started = time.perf_counter()
+    server = subprocess.Popen(command, cwd=app_dir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f'no answer within {timeout}s')
+            try:
+                timed_request(base + path)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        result = {'first_response': time.perf_counter() - started,
+                  'first_page': timed_request(base + '/')}
+
+        for name, document in zip(('first_upload', 'second_upload'), documents):
+            with open(document, 'rb') as f:
+                body, content_type = multipart({'input_codes': input_codes, 'voci_codes': ''},
+                                               {'file': (os.path.basename(document), f.read())})
+            result[name] = timed_request(base + '/', body, content_type)
+        return result
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the cold start of the app under gunicorn.')
+    parser.add_argument('--app-dir', default=REPO_DIR,
+                        help='checkout to start gunicorn in (default: this one)')
+    parser.add_argument('--path', default='/healthz',
+                        help='URL polled until the server answers (use / for older checkouts)')
+    parser.add_argument('--runs', type=int, default=5, help='server starts to time')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for the first answer')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='werscode-cold-') as directory:
+        # Two documents of the same size, so the second upload is parsed too
+        documents = [os.path.join(directory, f'small{seed}.docx') for seed in (0, 1)]
+        codes = [generate(document, seed=seed) for seed, document in enumerate(documents)][0]
+        runs = [cold_start(os.path.abspath(args.app_dir), args.path, documents,
+                           '\n'.join(codes), args.workers, args.timeout)
+                for _ in range(args.runs)]
+
+    summary = {}
+    for name in runs[0]:
+        times = [run[name] for run in runs]
+        summary[name] = {'min': min(times), 'median': statistics.median(times),
+                         'max': max(times)}
+        print(f'{name:<16} median {summary[name]["median"] * 1000:8.1f} ms'
+              f'   min {summary[name]["min"] * 1000:8.1f} ms'
+              f'   max {summary[name]["max"] * 1000:8.1f} ms')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'app_dir': os.path.abspath(args.app_dir), 'workers': args.workers,
+                       'runs': runs, 'summary': summary}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+import argparse
+import json
+import os
+import random
+import runpy
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+# Load test of the gunicorn deployment: starts the app under
+# gunicorn_config.py on localhost, replays a mix of synthetic uploads (several
+# document sizes and code list lengths) at a fixed concurrency and reports
+# throughput, latency percentiles, error and timeout rates and the peak RSS
+# of every gunicorn process. --sweep repeats the run for several
+# worker/thread/worker-class combinations and writes a comparison table.
+#
+#   python -m benchmarks.load_test --concurrency 8 --requests 200
+#   python -m benchmarks.load_test --sweep 1x4,2x2,4x1,2x1:sync,4x2 --table sweep.md
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from benchmarks.cold_start import free_port, multipart
+from benchmarks.synthetic import SIZES, generate, make_codes
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def parse_combination(text):
+    # 'WORKERSxTHREADS[:CLASS]', e.g. 2x4 or 4x1:sync
+    shape, _, worker_class = text.partition(':')
+    workers, _, threads = shape.partition('x')
+    return {'workers': int(workers), 'threads': int(threads or 1),
+            'worker_class': worker_class or 'gthread'}
+
+def build_requests(directory, sizes, code_counts, variants, seed):
+    # Upload bodies for every size and code list length; each size has a few
+    # documents so that workers do not parse the same bytes every time
+    requests = []
+    for size in sizes:
+        for variant in range(variants):
+            path = os.path.join(directory, f'{size}-{variant}.docx')
+            codes = generate(path, seed=seed + variant, **SIZES[size])
+            with open(path, 'rb') as f:
+                data = f.read()
+            for count in code_counts:
+                # Up to half of the codes occur in the document, as with a real list
+                present = codes[:count // 2]
+                input_codes = present + make_codes(count - len(present), seed + 1000 + variant)
+                body, content_type = multipart(
+                    {'input_codes': '\n'.join(input_codes), 'voci_codes': ''},
+                    {'file': (os.path.basename(path), data)})
+                requests.append({'size': size, 'codes': count, 'body': body,
+                                 'content_type': content_type})
+    return requests
+
+def process_rss(pid):
+    # Resident set size of a process in bytes, from /proc (Linux only)
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def process_pss(pid):
+    # Proportional set size in bytes: pages shared with other processes, such
+    # as those a preloaded master shares with its workers, count in part
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def child_pids(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+class RssSampler(threading.Thread):
+    # Samples the RSS and PSS of the gunicorn master and its workers until
+    # stopped, keeping the peaks of every process seen
+    def __init__(self, master_pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}
+        self.pss_peaks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(self.interval)
+
+    def sample(self):
+        for pid in [self.master_pid] + child_pids(self.master_pid):
+            rss = process_rss(pid)
+            if rss is not None:
+                self.peaks[pid] = max(self.peaks.get(pid, 0), rss)
+            pss = process_pss(pid)
+            if pss is not None:
+                self.pss_peaks[pid] = max(self.pss_peaks.get(pid, 0), pss)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+@contextmanager
+def gunicorn_server(app_dir, combination, env, timeout=60):
+    # gunicorn with the deployment config, its worker settings replaced by
+    # combination; yields the base URL and the master process once it answers
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn_config.py',
+               '-b', f'127.0.0.1:{port}', '--workers', str(combination['workers']),
+               '--threads', str(combination['threads']),
+               '--worker-class', combination['worker_class']]
+    server = subprocess.Popen(command, cwd=app_dir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        started = time.perf_counter()
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f'no answer within {timeout}s')
+            try:
+                with urllib.request.urlopen(base + '/healthz', timeout=5) as response:
+                    response.read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+        # Wait for every worker to be forked, not just the first to answer
+        while len(child_pids(server.pid)) < combination['workers'] and os.path.isdir('/proc'):
+            if time.perf_counter() - started > timeout:
+                break
+            time.sleep(0.05)
+        yield base, server
+    finally:
+        server.terminate()
+        server.wait()
+
+def send(url, request, timeout):
+    # (seconds, outcome): outcome is 'ok', 'error' or 'timeout'
+    http_request = urllib.request.Request(url, data=request['body'])
+    http_request.add_header('Content-Type', request['content_type'])
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            response.read()
+        outcome = 'ok'
+    except socket.timeout:
+        outcome = 'timeout'
+    except urllib.error.URLError as exc:
+        outcome = 'timeout' if isinstance(exc.reason, socket.timeout) else 'error'
+    except (ConnectionError, OSError):
+        outcome = 'error'
+    return time.perf_counter() - started, outcome
+
+def percentile(values, percent):
+    # Nearest-rank percentile of sorted values
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
+
+def run_load(url, requests, count, concurrency, timeout, seed):
+    # Send count requests, drawn at random from requests, from concurrency
+    # client threads; returns one (request, seconds, outcome) per request and
+    # the wall time taken
+    rnd = random.Random(seed)
+    plan = [rnd.choice(requests) for _ in range(count)]
+    results = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                if not plan:
+                    return
+                request = plan.pop()
+            seconds, outcome = send(url, request, timeout)
+            with lock:
+                results.append((request, seconds, outcome))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+def summarize(results, elapsed):
+    latencies = sorted(seconds for request, seconds, outcome in results if outcome == 'ok')
+    total = len(results)
+    summary = {
+        'requests': total,
+        'seconds': elapsed,
+        'throughput': sum(1 for result in results if result[2] == 'ok') / elapsed,
+        'error_rate': sum(1 for result in results if result[2] == 'error') / total,
+        'timeout_rate': sum(1 for result in results if result[2] == 'timeout') / total,
+    }
+    for percent in (50, 95, 99):
+        summary[f'p{percent}'] = percentile(latencies, percent)
+
+    # The same percentiles for each document size and code list length
+    mix = {}
+    for request, seconds, outcome in results:
+        if outcome == 'ok':
+            mix.setdefault(f"{request['size']}/{request['codes']}", []).append(seconds)
+    summary['mix'] = {name: {'requests': len(times),
+                             'p50': percentile(sorted(times), 50),
+                             'p95': percentile(sorted(times), 95)}
+                      for name, times in sorted(mix.items())}
+    return summary
+
+def load_test(args, combination, requests):
+    work_dir = tempfile.mkdtemp(prefix='werscode-load-')
+    env = dict(os.environ,
+               JOBS_DIR=os.path.join(work_dir, 'jobs'),
+               METRICS_DIR=os.path.join(work_dir, 'metrics'),
+               UPLOAD_FOLDER=os.path.join(work_dir, 'uploads'),
+               CATALOG_PATH=os.path.join(work_dir, 'catalog.sqlite3'),
+               LOG_LEVEL='WARNING')
+    if args.cache:
+        env['PARSE_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    else:
+        # Every upload is parsed, as with documents never seen before
+        env.update(PARSE_CACHE_DIR='', PARSE_CACHE_SIZE='0')
+    try:
+        with gunicorn_server(args.app_dir, combination, env) as (base, server):
+            url = base + args.path
+            if args.warmup:
+                run_load(url, requests, args.warmup, args.concurrency, args.timeout, args.seed)
+            sampler = RssSampler(server.pid)
+            sampler.start()
+            try:
+                results, elapsed = run_load(url, requests, args.requests, args.concurrency,
+                                            args.timeout, args.seed + 1)
+            finally:
+                sampler.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    summary = summarize(results, elapsed)
+    summary.update(combination, concurrency=args.concurrency)
+    summary['master_rss'] = sampler.peaks.pop(server.pid, None)
+    summary['worker_rss'] = sorted(sampler.peaks.values())
+    # Sum of the peaks, so an upper bound of the memory the deployment needs
+    summary['total_pss'] = sum(sampler.pss_peaks.values()) if sampler.pss_peaks else None
+    return summary
+
+def milliseconds(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.0f}'
+
+def megabytes(size):
+    return '-' if size is None else f'{size / 2 ** 20:.0f}'
+
+def comparison_table(summaries):
+    # Markdown table, one row per worker/thread/worker-class combination
+    lines = ['| workers | threads | class | req/s | p50 ms | p95 ms | p99 ms | errors | '
+             'timeouts | worker RSS MB | total PSS MB |',
+             '|---|---|---|---|---|---|---|---|---|---|---|']
+    for summary in summaries:
+        lines.append(
+            f"| {summary['workers']} | {summary['threads']} | {summary['worker_class']} "
+            f"| {summary['throughput']:.1f} | {milliseconds(summary['p50'])} "
+            f"| {milliseconds(summary['p95'])} | {milliseconds(summary['p99'])} "
+            f"| {summary['error_rate']:.1%} | {summary['timeout_rate']:.1%} "
+            f"| {' '.join(megabytes(rss) for rss in summary['worker_rss']) or '-'} "
+            f"| {megabytes(summary['total_pss'])} |")
+    return '\n'.join(lines) + '\n'
+
+def print_summary(summary):
+    print(f"{summary['workers']} workers x {summary['threads']} threads "
+          f"({summary['worker_class']}), concurrency {summary['concurrency']}: "
+          f"{summary['requests']} requests in {summary['seconds']:.1f}s")
+    print(f"  throughput {summary['throughput']:.1f} req/s   p50 {milliseconds(summary['p50'])} ms"
+          f"   p95 {milliseconds(summary['p95'])} ms   p99 {milliseconds(summary['p99'])} ms")
+    print(f"  errors {summary['error_rate']:.1%}   timeouts {summary['timeout_rate']:.1%}"
+          f"   master RSS {megabytes(summary['master_rss'])} MB   worker RSS "
+          f"{' '.join(megabytes(rss) for rss in summary['worker_rss']) or '-'} MB"
+          f"   total PSS {megabytes(summary['total_pss'])} MB")
+    for name, mix in summary['mix'].items():
+        print(f"  {name:<16} {mix['requests']:5d} requests   p50 {milliseconds(mix['p50'])} ms"
+              f"   p95 {milliseconds(mix['p95'])} ms")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the app under gunicorn.')
+    parser.add_argument('--app-dir', default=REPO_DIR,
+                        help='checkout to start gunicorn in (default: this one)')
+    parser.add_argument('--path', default='/', help='URL the uploads are posted to')
+    parser.add_argument('--sizes', default='small,medium',
+                        help='comma separated document sizes: ' + ', '.join(SIZES))
+    parser.add_argument('--code-counts', default='50,1000',
+                        help='comma separated code list lengths')
+    parser.add_argument('--variants', type=int, default=3, help='documents per size')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight')
+    parser.add_argument('--requests', type=int, default=200, help='requests measured per run')
+    parser.add_argument('--warmup', type=int, default=16,
+                        help='requests sent before measuring')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds per request')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the parse cache on (repeated documents are not parsed again)')
+    parser.add_argument('--workers', type=int, help='gunicorn workers (default: the config)')
+    parser.add_argument('--threads', type=int, help='threads per worker (default: the config)')
+    parser.add_argument('--worker-class', help='gunicorn worker class (default: the config)')
+    parser.add_argument('--sweep', help='comma separated WORKERSxTHREADS[:CLASS] '
+                                        'combinations, e.g. 2x4,4x1:sync')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--table', help='write the comparison table (Markdown) to this file')
+    args = parser.parse_args(argv)
+    args.app_dir = os.path.abspath(args.app_dir)
+
+    if args.sweep:
+        combinations = [parse_combination(text) for text in args.sweep.split(',')]
+    else:
+        # The deployment's own settings unless overridden
+        config = runpy.run_path(os.path.join(args.app_dir, 'gunicorn_config.py'))
+        combinations = [{'workers': args.workers or config.get('workers', 1),
+                         'threads': args.threads or config.get('threads', 1),
+                         'worker_class': args.worker_class or config.get('worker_class', 'sync')}]
+
+    with tempfile.TemporaryDirectory(prefix='werscode-load-') as directory:
+        requests = build_requests(directory, args.sizes.split(','),
+                                  [int(count) for count in args.code_counts.split(',')],
+                                  args.variants, args.seed)
+        summaries = []
+        for combination in combinations:
+            summary = load_test(args, combination, requests)
+            print_summary(summary)
+            summaries.append(summary)
+
+    table = comparison_table(summaries)
+    print()
+    print(table, end='')
+    if args.table:
+        with open(args.table, 'w') as f:
+            f.write(table)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'app_dir': args.app_dir, 'concurrency': args.concurrency,
+                       'sizes': args.sizes, 'code_counts': args.code_counts,
+                       'results': summaries}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
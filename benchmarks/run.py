@@ -0,0 +1,151 @@
+import argparse
+import atexit
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks for the extraction pipeline on synthetic documents. Each target
+# is timed over several repeats, then run once more under tracemalloc for its
+# peak Python memory (tracemalloc slows code down, so timings never include
+# it). Results are written as JSON; --compare prints the change against an
+# earlier run.
+#
+#   python -m benchmarks.run --sizes small,medium -o before.json
+#   python -m benchmarks.run --sizes small,medium -o after.json --compare before.json
+
+# Parse results must not come from the cache, and nothing should be written
+# next to a real deployment's catalog, reports, jobs or metrics
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+START_DIR = os.getcwd()
+WORK_DIR = tempfile.mkdtemp(prefix='werscode-bench-')
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.environ['PARSE_CACHE_DIR'] = ''
+os.environ['PARSE_CACHE_SIZE'] = '0'
+os.environ['CATALOG_PATH'] = os.path.join(WORK_DIR, 'catalog.sqlite3')
+os.environ['JOBS_DIR'] = os.path.join(WORK_DIR, 'jobs')
+os.environ['METRICS_DIR'] = os.path.join(WORK_DIR, 'metrics')
+os.chdir(WORK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import app as wers
+from benchmarks.synthetic import SIZES, generate, make_codes
+
+def measure(func, repeat):
+    # The traced run goes first and doubles as a warm-up for the timed runs
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+
+    return {'min': min(times), 'median': statistics.median(times),
+            'max': max(times), 'peak_bytes': peak}
+
+def upload(client, path, input_codes):
+    with open(path, 'rb') as f:
+        data = {'file': (io.BytesIO(f.read()), os.path.basename(path)),
+                'input_codes': input_codes, 'voci_codes': ''}
+    response = client.post('/', data=data, content_type='multipart/form-data')
+    if response.status_code != 200:
+        raise RuntimeError(f'upload failed with status {response.status_code}')
+
+def benchmark_size(size, options, engines, repeat, code_density, seed):
+    path = os.path.join(WORK_DIR, f'{size}.docx')
+    codes = generate(path, code_density=code_density, seed=seed, **options)
+    # Half of the requested codes never occur, as with a real code list
+    input_codes = codes + make_codes(len(codes), seed + 1)
+    input_text = '\n'.join(input_codes)
+    client = wers.app.test_client()
+
+    results = {'options': dict(options, code_density=code_density),
+               'file_bytes': os.path.getsize(path), 'engines': {}}
+    for engine in engines:
+        wers.app.config['EXTRACTION_ENGINE'] = engine
+        text = wers.extract_text_from_docx(path)
+        targets = {
+            'extract_text_from_docx': lambda: wers.extract_text_from_docx(path),
+            # Through the selected engine: extract_codes_and_descriptions()
+            # takes a python-docx Document whatever the engine
+            'extract_codes_and_descriptions':
+                lambda: wers.parse_document(path).codes_with_descriptions,
+            'extract_codes_from_text': lambda: wers.extract_codes_from_text(text, input_codes),
+            'upload_file': lambda: upload(client, path, input_text),
+        }
+        timings = {}
+        for name, func in targets.items():
+            timings[name] = measure(func, repeat)
+            print(f'{size:>8} {engine:<12} {name:<32} '
+                  f'{timings[name]["median"] * 1000:9.1f} ms '
+                  f'{timings[name]["peak_bytes"] / 2 ** 20:8.1f} MiB', file=sys.stderr)
+        results['engines'][engine] = timings
+    return results
+
+def compare(current, previous):
+    # Median time and peak memory of this run relative to the earlier one
+    print(f'{"size":>8} {"engine":<12} {"target":<32} {"time":>8} {"memory":>8}')
+    for size, result in current['sizes'].items():
+        before = previous['sizes'].get(size)
+        if before is None:
+            continue
+        for engine, timings in result['engines'].items():
+            for name, timing in timings.items():
+                old = before['engines'].get(engine, {}).get(name)
+                if old is None:
+                    continue
+                time_change = timing['median'] / old['median'] - 1 if old['median'] else 0.0
+                memory_change = (timing['peak_bytes'] / old['peak_bytes'] - 1
+                                 if old['peak_bytes'] else 0.0)
+                print(f'{size:>8} {engine:<12} {name:<32} {time_change:+8.1%} {memory_change:+8.1%}')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark WERS code extraction.')
+    parser.add_argument('--sizes', default='small,medium',
+                        help='comma separated document sizes: ' + ', '.join(SIZES))
+    parser.add_argument('--engines', default=','.join(sorted(wers.EXTRACTION_ENGINES)),
+                        help='comma separated extraction engines')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per target')
+    parser.add_argument('--code-density', type=float, default=0.3,
+                        help='share of paragraphs and cells that mention a code')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    sizes = [size for size in args.sizes.split(',') if size]
+    engines = [engine for engine in args.engines.split(',') if engine]
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f'unknown size {size!r}')
+    for engine in engines:
+        if engine not in wers.EXTRACTION_ENGINES:
+            parser.error(f'unknown engine {engine!r}')
+
+    results = {'created': time.time(), 'python': platform.python_version(),
+               'platform': platform.platform(), 'repeat': args.repeat, 'sizes': {}}
+    for size in sizes:
+        results['sizes'][size] = benchmark_size(size, SIZES[size], engines, args.repeat,
+                                                args.code_density, args.seed)
+
+    if args.output:
+        with open(os.path.join(START_DIR, args.output), 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(os.path.join(START_DIR, args.compare), encoding='utf-8') as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import random
+
+from docx import Document
+from docx.enum.section import WD_SECTION
+
+# Synthetic WERS-like .docx documents for benchmarks and load tests. Size and
+# shape are controlled by paragraph, table and section counts; code_density
+# is the share of paragraphs and cells that mention a code.
+
+SIZES = {
+    'small': {'paragraphs': 200, 'tables': 5, 'rows': 10, 'sections': 2},
+    'medium': {'paragraphs': 2000, 'tables': 40, 'rows': 20, 'sections': 4},
+    'large': {'paragraphs': 10000, 'tables': 150, 'rows': 30, 'sections': 8},
+}
+
+WORDS = ('package option trim stripe wheel appearance premium interior exterior '
+         'seat console mirror badge lamp roof spoiler paint finish edition').split()
+
+def make_codes(count, seed=0):
+    # Five character codes shaped like WERS codes: a letter prefix and suffix
+    rnd = random.Random(seed)
+    alphabet = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    codes = set()
+    while len(codes) < count:
+        codes.add(rnd.choice('ABCDEFGHJK') + ''.join(rnd.choice(alphabet) for _ in range(4)))
+    return sorted(codes)
+
+def _sentence(rnd, words=6):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words)).capitalize()
+
+def _text(rnd, codes, code_density):
+    # Plain text, or a description line ending with a code
+    if rnd.random() < code_density:
+        return f'{_sentence(rnd)} ({rnd.randint(10, 999)}A) {rnd.choice(codes)}'
+    return _sentence(rnd, rnd.randint(4, 14))
+
+def generate(path, paragraphs=200, tables=5, rows=10, cols=4, sections=2,
+             code_density=0.3, codes=None, seed=0):
+    rnd = random.Random(seed)
+    codes = codes or make_codes(200, seed)
+    doc = Document()
+
+    per_section = max(1, sections)
+    for section_num in range(per_section):
+        if section_num:
+            doc.add_section(WD_SECTION.NEW_PAGE)
+        section = doc.sections[-1]
+        section.header.is_linked_to_previous = False
+        section.header.paragraphs[0].text = f'WERS Specification {_text(rnd, codes, code_density)}'
+        section.footer.is_linked_to_previous = False
+        section.footer.paragraphs[0].text = f'Page footer {section_num + 1}'
+
+        for _ in range(paragraphs // per_section):
+            doc.add_paragraph(_text(rnd, codes, code_density))
+
+        for _ in range(tables // per_section):
+            table = doc.add_table(rows=rows, cols=cols)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = _text(rnd, codes, code_density)
+            # Horizontal and vertical merges, as in the option tables
+            table.cell(0, 0).merge(table.cell(0, cols - 1))
+            if rows > 3:
+                table.cell(1, 0).merge(table.cell(rows // 2, 0))
+            if cols > 2 and rows > 2:
+                table.cell(rows - 1, 1).merge(table.cell(rows - 1, cols - 1))
+
+    doc.save(path)
+    return codes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic WERS .docx document.')
+    parser.add_argument('path')
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--paragraphs', type=int)
+    parser.add_argument('--tables', type=int)
+    parser.add_argument('--rows', type=int)
+    parser.add_argument('--sections', type=int)
+    parser.add_argument('--code-density', type=float, default=0.3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    options = dict(SIZES[args.size])
+    for name in ('paragraphs', 'tables', 'rows', 'sections'):
+        if getattr(args, name) is not None:
+            options[name] = getattr(args, name)
+    generate(args.path, code_density=args.code_density, seed=args.seed, **options)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import time
+
+# Persistent catalog of every code description seen in processed documents,
+# kept in SQLite so all gunicorn workers (and the CLI) share it. It backs
+# descriptions for codes the current document does not describe and answers
+# prefix searches without re-parsing anything.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS codes (
+    code TEXT PRIMARY KEY,
+    description TEXT NOT NULL,
+    source TEXT,
+    last_seen REAL NOT NULL
+)
+'''
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_BATCH = 500
+
+class CodeCatalog:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread; WAL lets readers run while a worker writes.
+        # Nothing is opened until the catalog is first used, so a gunicorn
+        # master that preloads the app never holds a connection its workers
+        # would inherit.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.row_factory = sqlite3.Row
+            with conn:
+                conn.execute(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def record(self, codes_with_descriptions, source):
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                'INSERT INTO codes (code, description, source, last_seen) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(code) DO UPDATE SET description = excluded.description, '
+                'source = excluded.source, last_seen = excluded.last_seen',
+                [(code, desc, source, now) for code, desc in codes_with_descriptions.items()])
+
+    def lookup(self, codes):
+        codes = list(codes)
+        descriptions = {}
+        conn = self._connection()
+        for start in range(0, len(codes), LOOKUP_BATCH):
+            batch = codes[start:start + LOOKUP_BATCH]
+            rows = conn.execute(
+                'SELECT code, description FROM codes WHERE code IN (%s)' % ','.join('?' * len(batch)),
+                batch)
+            descriptions.update((row['code'], row['description']) for row in rows)
+        return descriptions
+
+    def search(self, prefix, limit=50):
+        # A range scan on the primary key rather than LIKE, so the index is used
+        if prefix:
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            rows = self._connection().execute(
+                'SELECT * FROM codes WHERE code >= ? AND code < ? ORDER BY code LIMIT ?',
+                (prefix, upper, limit))
+        else:
+            rows = self._connection().execute(
+                'SELECT * FROM codes ORDER BY code LIMIT ?', (limit,))
+        return [dict(row) for row in rows]
@@ -0,0 +1,184 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import app as wers
+from code_lists import read_code_list
+
+# Batch mode: run the extractor over a directory of .docx files without the
+# web server. Files are fanned out over a process pool, results are appended
+# to one CSV or JSON Lines file as each document finishes, and files already
+# recorded in that output (same path and content) are skipped on the next run;
+# failed files are retried.
+#
+#   python cli.py archive/ --codes wers.txt --voci voci.txt -o results.csv -w 8
+
+CSV_FIELDS = ['document', 'sha256', 'status', 'code', 'source', 'description', 'hits', 'error']
+
+def file_sha256(path, chunk_size=1 << 16):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def find_documents(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            # Skip Word's "~$" lock files
+            if name.lower().endswith('.docx') and not name.startswith('~$'):
+                yield os.path.join(root, name)
+
+def read_code_file(path):
+    if not path:
+        return []
+    with open(path, 'rb') as f:
+        code_list = read_code_list(f)
+    print(f'{path}: {len(code_list.codes)} codes, {code_list.duplicates} duplicates, '
+          f'{code_list.invalid} lines without a code', file=sys.stderr)
+    return code_list.codes
+
+def process_file(path, sha256, input_codes, voci_codes, engine):
+    # Runs in a pool process
+    record = {'document': path, 'sha256': sha256}
+    try:
+        wers.app.config['EXTRACTION_ENGINE'] = engine
+        parsed = wers.parse_document(path)
+        parsed.key = sha256
+        wers.record_in_catalog(parsed, path)
+        analysis = wers.analyze_parsed([parsed], input_codes, voci_codes)
+    except Exception as exc:
+        record['error'] = f'{type(exc).__name__}: {exc}'
+        return record
+    record['codes'] = wers.code_records(analysis['code_results'])
+    record['time_metrics'] = analysis['time_metrics']
+    return record
+
+class CsvOutput:
+    def __init__(self, path):
+        self.path = path
+
+    def processed(self):
+        with open(self.path, newline='', encoding='utf-8') as f:
+            # Failed documents are not recorded as done so the next run retries them
+            return {(row['document'], row['sha256']) for row in csv.DictReader(f)
+                    if row['status'] != 'error'}
+
+    def open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self.file = open(self.path, 'a', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+        if new_file:
+            self.writer.writeheader()
+
+    def write(self, record):
+        base = {'document': record['document'], 'sha256': record['sha256']}
+        if 'error' in record:
+            self.writer.writerow(dict(base, status='error', error=record['error']))
+        elif not record['codes']:
+            self.writer.writerow(dict(base, status='ok'))
+        for code in record.get('codes', []):
+            self.writer.writerow(dict(base, status='ok', code=code['code'], source=code['source'],
+                                      description=code['description'], hits=code['hits']))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class JsonLinesOutput(CsvOutput):
+    def processed(self):
+        done = set()
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A run that was killed mid-write leaves a partial last line
+                    continue
+                if 'error' not in record:
+                    done.add((record['document'], record['sha256']))
+        return done
+
+    def open(self):
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract WERS codes from a directory of .docx files.')
+    parser.add_argument('directory', help='directory searched recursively for .docx files')
+    parser.add_argument('--codes', help='text file with the WERS codes to look for')
+    parser.add_argument('--voci', help='text file with the VOCI codes')
+    parser.add_argument('-o', '--output', required=True,
+                        help='results file; .csv for CSV, anything else for JSON Lines')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: number of CPUs)')
+    parser.add_argument('--engine', default=wers.app.config['EXTRACTION_ENGINE'],
+                        choices=sorted(wers.EXTRACTION_ENGINES), help='extraction engine')
+    parser.add_argument('--progress-every', type=int, default=50,
+                        help='report throughput after this many files')
+    args = parser.parse_args(argv)
+
+    input_codes = read_code_file(args.codes)
+    voci_codes = read_code_file(args.voci)
+    output_class = CsvOutput if args.output.lower().endswith('.csv') else JsonLinesOutput
+    output = output_class(args.output)
+    processed = output.processed() if os.path.exists(args.output) else set()
+
+    # Hash up front so unchanged files from an earlier run are skipped
+    pending = []
+    skipped = 0
+    for path in find_documents(args.directory):
+        sha256 = file_sha256(path)
+        if (path, sha256) in processed:
+            skipped += 1
+        else:
+            pending.append((path, sha256))
+    print(f'{len(pending)} files to process, {skipped} already done', file=sys.stderr)
+
+    output.open()
+    started = time.perf_counter()
+    done = failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            queue = iter(pending)
+            futures = set()
+            while True:
+                # Keep a couple of files per worker in flight, not the whole archive
+                while len(futures) < 2 * args.workers:
+                    item = next(queue, None)
+                    if item is None:
+                        break
+                    futures.add(pool.submit(process_file, item[0], item[1],
+                                            input_codes, voci_codes, args.engine))
+                if not futures:
+                    break
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    output.write(record)
+                    done += 1
+                    failed += 'error' in record
+                    if done % args.progress_every == 0:
+                        elapsed = time.perf_counter() - started
+                        print(f'{done}/{len(pending)} files, {done / elapsed:.1f} files/s',
+                              file=sys.stderr)
+    finally:
+        output.close()
+
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0.0
+    print(f'Processed {done} files ({failed} failed) in {elapsed:.1f}s: {rate:.1f} files/s',
+          file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import codecs
+import re
+from collections import namedtuple
+
+# Streaming reader for uploaded WERS/VOCI code lists (plain text or CSV, as
+# exported from VOCI). The file is read and decoded a chunk at a time; the
+# complete lines of each chunk are scanned with a few regexes, which keep
+# every field that is a five character code, in first-seen order, once. Only
+# the unique codes and the unfinished last line of a chunk are held in
+# memory, never the whole file.
+#
+# A line with text but no code in it (a CSV header, a stray note) is counted
+# as invalid; a code seen again is counted as a duplicate.
+
+CodeList = namedtuple('CodeList', 'codes duplicates invalid')
+
+CHUNK_SIZE = 1 << 16
+
+# An unfinished line longer than this is cut after its last separator and the
+# head counted as a line of its own, so a file without line breaks cannot make
+# the carried-over text grow without bound. With no separator at all it is a
+# single field too long to be a code: it counts as an invalid line and the
+# rest of the field is skipped as it arrives.
+MAX_LINE = 1 << 16
+
+# A code is a whole field: separated by whitespace, commas, semicolons or
+# pipes, optionally quoted
+SEPARATOR = r'[\s,;|"\']'
+NOT_SEPARATOR = r'[^\s,;|"\']'
+CODE_FIELD = re.compile(r'(?<!' + NOT_SEPARATOR + r')[A-Z0-9]{5}(?!' + NOT_SEPARATOR + r')')
+LINE_WITH_CODE = re.compile(r'^[^\n]*?' + CODE_FIELD.pattern, re.MULTILINE)
+NON_BLANK_LINE = re.compile(r'^[^\S\n]*\S', re.MULTILINE)
+LAST_FIELD = re.compile(r'(.*' + SEPARATOR + r'|)(.*)', re.DOTALL)
+FIELD_REST = re.compile(NOT_SEPARATOR + r'*')
+
+def read_code_list(stream, chunk_size=CHUNK_SIZE):
+    # stream is a binary file object positioned at the start of the list
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    reader = _CodeListReader()
+    carry = ''
+    in_long_field = False
+    while True:
+        chunk = stream.read(chunk_size)
+        text = carry + decoder.decode(chunk, final=not chunk)
+        if in_long_field:
+            rest = FIELD_REST.match(text).end()
+            in_long_field = rest == len(text)
+            text = text[rest:]
+        if not chunk:
+            reader.add_lines(text)
+            return reader.result()
+
+        # The last line may continue in the next chunk
+        end = max(text.rfind('\n'), text.rfind('\r')) + 1
+        carry = text[end:]
+        reader.add_lines(text[:end])
+        if len(carry) > MAX_LINE:
+            head, carry = LAST_FIELD.match(carry).groups()
+            if head:
+                reader.add_lines(head)
+            else:
+                reader.invalid += 1
+                carry = ''
+                in_long_field = True
+
+class _CodeListReader:
+    def __init__(self):
+        self.codes = {}
+        self.duplicates = 0
+        self.invalid = 0
+
+    def add_lines(self, text):
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        found = CODE_FIELD.findall(text)
+        if found:
+            known = len(self.codes)
+            self.codes.update(dict.fromkeys(found))
+            self.duplicates += len(found) - (len(self.codes) - known)
+        self.invalid += (len(NON_BLANK_LINE.findall(text))
+                         - (len(LINE_WITH_CODE.findall(text)) if found else 0))
+
+    def result(self):
+        return CodeList(list(self.codes), self.duplicates, self.invalid)
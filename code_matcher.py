@@ -0,0 +1,32 @@
+import re
+from collections import Counter
+
+# Multi-pattern matcher for WERS codes. Instead of a substring scan per code,
+# the text is split once into standalone uppercase alphanumeric tokens and
+# each token is looked up in a hash set, so the cost is linear in the text
+# whatever the number of codes. A code only counts when it is a whole token:
+# CJTAB is not found inside CJTABX.
+
+class CodeMatcher:
+    def __init__(self, codes):
+        self.codes = frozenset(codes)
+        self.token_pattern = None
+        if self.codes:
+            lengths = [len(code) for code in self.codes]
+            self.token_pattern = re.compile(
+                r'(?<![A-Za-z0-9])[A-Z0-9]{%d,%d}(?![A-Za-z0-9])' % (min(lengths), max(lengths)))
+
+    def count(self, text):
+        # Hits per code in a single pass over the text
+        if self.token_pattern is None:
+            return Counter()
+        codes = self.codes
+        return Counter(token for token in self.token_pattern.findall(text) if token in codes)
+
+    def count_index(self, code_index):
+        # Hits per code from the token -> count index built during extraction
+        # (ParsedDocument.code_index holds every standalone 4-5 character token)
+        return Counter({code: code_index[code] for code in self.codes if code_index.get(code)})
+
+    def find(self, text):
+        return set(self.count(text))
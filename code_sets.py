@@ -0,0 +1,126 @@
+import re
+from array import array
+from itertools import repeat
+from operator import or_
+
+# Compact code sets. A 4-5 character [A-Z0-9] code is packed into one integer
+# and a set of codes is a sorted array of those integers, 4 bytes a code
+# instead of a str in a hash set. Membership of many codes in several sets is
+# worked out a whole set at a time, with numpy when it is installed and plain
+# int sets otherwise.
+#
+# A code is read as a base 36 number behind a leading 1, so "0ABC" and
+# "00ABC" stay different; every packed code fits in 27 bits.
+
+CODE_LIST_PATTERN = re.compile(r'(?:[A-Z0-9]{4,5}\n)*[A-Z0-9]{4,5}')
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# numpy is imported on first use, not with this module, so that starting the
+# app does not pay for it; None until then, False when it is not installed
+_numpy_module = None
+
+def _numpy():
+    global _numpy_module, DIGIT_VALUES, PLACE_VALUES
+    if _numpy_module is None:
+        try:
+            import numpy as module
+        except ImportError:
+            _numpy_module = False
+            return None
+        # Digit value of every byte, -1 for bytes that cannot be in a code
+        DIGIT_VALUES = module.full(256, -1, dtype=module.int8)
+        for value, char in enumerate(ALPHABET):
+            DIGIT_VALUES[ord(char)] = value
+        PLACE_VALUES = module.array([36 ** 4, 36 ** 3, 36 ** 2, 36, 1], dtype=module.uint32)
+        _numpy_module = module
+    return _numpy_module or None
+
+def pack_code(code):
+    return pack_codes([code])[0]
+
+def unpack_code(value):
+    chars = []
+    while value >= 36:
+        value, digit = divmod(value, 36)
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+def pack_codes(codes):
+    # Packed codes in their original order, duplicates kept
+    codes = list(codes)
+    numpy = _numpy()
+    if numpy is not None and codes and set(map(len, codes)) == {5}:
+        # All five characters long, as parse_code_list() gives: convert the
+        # codes as one byte matrix
+        raw = ''.join(codes).encode('ascii', 'replace')
+        digits = DIGIT_VALUES[numpy.frombuffer(raw, dtype=numpy.uint8)].reshape(-1, 5)
+        if (digits < 0).any():
+            _raise_invalid(codes)
+        packed = (digits.astype(numpy.uint32) * PLACE_VALUES).sum(axis=1, dtype=numpy.uint32)
+        return array('I', (packed + 36 ** 5).astype(numpy.uint32).tobytes())
+
+    # Otherwise check them with one regex over all of them and let int() convert
+    if codes and not CODE_LIST_PATTERN.fullmatch('\n'.join(codes)):
+        _raise_invalid(codes)
+    return array('I', map(int, map('1'.__add__, codes), repeat(36)))
+
+def _raise_invalid(codes):
+    bad = next(code for code in codes if not CODE_LIST_PATTERN.fullmatch(code))
+    raise ValueError(f'not a WERS code: {bad!r}')
+
+class CodeSet:
+    def __init__(self, codes=(), packed=None):
+        values = packed if packed is not None else pack_codes(codes)
+        numpy = _numpy()
+        if numpy is not None:
+            if not isinstance(values, array):
+                values = array('I', values)
+            self.values = array('I', numpy.unique(_as_numpy(values)).tobytes())
+        else:
+            self.values = array('I', sorted(set(values)))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, code):
+        return bool(membership_masks(array('I', [pack_code(code)]), [self])[0])
+
+    def codes(self):
+        return [unpack_code(value) for value in self.values]
+
+    def intersection(self, other):
+        numpy = _numpy()
+        if numpy is not None:
+            return CodeSet(packed=numpy.intersect1d(
+                _as_numpy(self.values), _as_numpy(other.values), assume_unique=True).tolist())
+        return CodeSet(packed=set(self.values).intersection(other.values))
+
+    def difference(self, other):
+        numpy = _numpy()
+        if numpy is not None:
+            return CodeSet(packed=numpy.setdiff1d(
+                _as_numpy(self.values), _as_numpy(other.values), assume_unique=True).tolist())
+        return CodeSet(packed=set(self.values).difference(other.values))
+
+def _as_numpy(values):
+    # Shares the array's buffer rather than copying it
+    numpy = _numpy()
+    return numpy.frombuffer(values, dtype=numpy.uint32)
+
+def membership_masks(packed, code_sets):
+    # One bitmask per packed code: bit i is set when code_sets[i] holds it
+    numpy = _numpy()
+    if numpy is not None and len(packed) and len(code_sets) < 63:
+        query = _as_numpy(packed)
+        masks = numpy.zeros(len(query), dtype=numpy.int64)
+        for bit_index, code_set in enumerate(code_sets):
+            found = numpy.isin(query, _as_numpy(code_set.values))
+            masks |= found.astype(numpy.int64) << bit_index
+        return masks.tolist()
+
+    # Without numpy: one hash lookup per code and set, looped in C by map()
+    masks = [0] * len(packed)
+    for bit_index, code_set in enumerate(code_sets):
+        found = map(set(code_set.values).__contains__, packed)
+        masks = list(map(or_, masks, map((1 << bit_index).__mul__, found)))
+    return masks
@@ -0,0 +1,111 @@
+from collections import Counter
+
+from code_sets import CodeSet, membership_masks, pack_codes
+
+# Comparison engine for any number of WERS documents plus the VOCI list.
+# Membership of every code is recorded as a bitmask: bit 0 is VOCI and bit
+# i + 1 is document i. Source labels keep the wording (and precedence) of the
+# original two-document page: a code in VOCI is labelled with every document
+# it shares, otherwise with the first document it was found in.
+
+VOCI_BIT = 1
+
+def document_bit(index):
+    return 1 << (index + 1)
+
+def document_numbers(mask, document_count):
+    return [i + 1 for i in range(document_count) if mask & document_bit(i)]
+
+def join_numbers(numbers):
+    numbers = [str(number) for number in numbers]
+    if len(numbers) == 1:
+        return numbers[0]
+    return ', '.join(numbers[:-1]) + ' and ' + numbers[-1]
+
+def source_label(mask, document_count):
+    documents = document_numbers(mask, document_count)
+    if mask & VOCI_BIT:
+        if not documents:
+            return 'VOCI Only'
+        return 'Both VOCI and WERS Document ' + join_numbers(documents)
+    if documents:
+        return f'WERS Document {documents[0]} Only'
+    return None
+
+def compare_codes(document_hits, input_codes, voci_codes, descriptions):
+    # document_hits holds one code -> hit count mapping per document, in order.
+    # Rows follow the input order; VOCI codes that were not asked for follow.
+    # Membership is computed on packed code sets for all codes at once, and
+    # labels are worked out once per distinct mask.
+    document_count = len(document_hits)
+    input_packed = pack_codes(input_codes)
+    voci_packed = pack_codes(voci_codes)
+    code_sets = [CodeSet(packed=voci_packed)] + [CodeSet(hits) for hits in document_hits]
+    masks = membership_masks(input_packed, code_sets)
+    total_hits = Counter()
+    for hits in document_hits:
+        total_hits.update(hits)
+
+    labels = {}
+    code_results = []
+    for code, mask in zip(input_codes, masks):
+        if mask not in labels:
+            labels[mask] = (source_label(mask, document_count),
+                            document_numbers(mask, document_count))
+        source, documents = labels[mask]
+        if source is None:
+            continue
+        code_results.append((code, {
+            'source': source,
+            'description': descriptions.get(code, ''),
+            'hits': total_hits.get(code, 0),
+            'mask': mask,
+            'in_voci': bool(mask & VOCI_BIT),
+            'documents': list(documents)
+        }))
+
+    asked = membership_masks(voci_packed, [CodeSet(packed=input_packed)])
+    for code, in_input in zip(voci_codes, asked):
+        if not in_input:
+            code_results.append((code, {
+                'source': 'VOCI Only',
+                'description': descriptions.get(code, ''),
+                'hits': 0,
+                'mask': VOCI_BIT,
+                'in_voci': True,
+                'documents': []
+            }))
+
+    return code_results
+
+def result_categories(source):
+    # Filter categories of the results page a row belongs to
+    if source.startswith('Both VOCI and WERS'):
+        return [source, 'Both']
+    return [source]
+
+def index_categories(code_results):
+    # Row numbers per filter category, built once together with the results
+    index = {}
+    for row, (code, result) in enumerate(code_results):
+        for category in result_categories(result['source']):
+            index.setdefault(category, []).append(row)
+    return index
+
+def category_counts(code_results, categories):
+    counts = {category: len(rows) for category, rows in categories.items()}
+    counts['all'] = len(code_results)
+    return counts
+
+def results_page(code_results, categories, category, offset, limit):
+    # One page of a filtered view; rows are numbered within the filter
+    if category == 'all':
+        rows = range(len(code_results))
+    else:
+        rows = categories.get(category, [])
+    page = []
+    for number, row in enumerate(rows[offset:offset + limit], offset + 1):
+        code, result = code_results[row]
+        page.append({'number': number, 'code': code, 'source': result['source'],
+                     'description': result['description'], 'hits': result['hits']})
+    return {'category': category, 'total': len(rows), 'offset': offset, 'rows': page}
@@ -0,0 +1,115 @@
+import re
+from collections import namedtuple
+
+# Declarative rules for finding "description ... CODE" pairs. Every rule has a
+# scope (a body 'paragraph', a whole table 'row' or a single table 'cell'), a
+# pattern with 'desc' and 'code' groups and a precedence. For each piece of
+# text the rules of its scope are tried in order and the first match counts;
+# across the document a description from a higher precedence rule wins, and
+# for equal precedence the later one wins unless the rule keeps the first.
+# Rules of one scope share its precedence (rows over paragraphs over cells),
+# so a vehicle-line rule picks the description of the text it matches but a
+# later row or paragraph still replaces it, as it would any other.
+# Before any regex runs, a rule can require a literal in the text and the
+# characters the text may end with; it may also need a marker to have
+# appeared in an earlier paragraph.
+# Vehicle-line specific patterns are added here rather than as extra passes.
+
+Rule = namedtuple('Rule', 'name scope pattern precedence literal tail after keep_first',
+                  defaults=(None, None, None, False))
+
+CODE = r'(?P<code>[A-Z0-9]{4,5})'
+CODE_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789')
+
+# Description followed by a code at the very end of the text
+TRAILING_CODE = r'^(?P<desc>.*?)\s*' + CODE + r'$'
+
+RULES = [
+    # "Over-the-Top Stripe Package (47B) CJTAB"
+    Rule('package-row', 'row', r'^(?P<desc>.*?Package.*?)\s+' + CODE + r'\s*$', 30,
+         literal='Package', tail=CODE_CHARS),
+    # "Dark Horse Appearance Package (700A) CJTAD/..." or "... CJTAD$"
+    Rule('dark-horse-row', 'row', r'(?P<desc>Dark Horse.*?)\s+' + CODE + r'[/$]', 30,
+         literal='Dark Horse'),
+    Rule('row', 'row', TRAILING_CODE, 30, tail=CODE_CHARS),
+    # "-Top Racing Stripe CJTAB" lines following the Results heading
+    Rule('results-cjta', 'paragraph', r'^-+\s*(?P<desc>.*?)\s*(?P<code>CJTA[A-Z0-9])$', 20,
+         literal='CJTA', tail=CODE_CHARS, after='Results'),
+    # "GT and GT Premium Over-the-Top Stripe Package (47K) CJTAK"
+    Rule('package', 'paragraph', r'^(?P<desc>.*?Package.*?)\s+' + CODE + r'\s*$', 20,
+         literal='Package', tail=CODE_CHARS),
+    Rule('paragraph', 'paragraph', TRAILING_CODE, 20, tail=CODE_CHARS),
+    # A cell only describes a code nothing else has described
+    Rule('cell', 'cell', TRAILING_CODE, 10, tail=CODE_CHARS, keep_first=True),
+]
+
+# "Note: ..." is dropped from paragraph and row text before matching
+NOTE_PATTERN = re.compile(r'Note:.*$')
+NOTE_SCOPES = ('paragraph', 'row')
+
+class RuleSet:
+    # Rules compiled once and grouped by scope, keeping their order
+    def __init__(self, rules=RULES):
+        self.scopes = {}
+        for rule in rules:
+            self.scopes.setdefault(rule.scope, []).append(
+                (re.compile(rule.pattern), rule))
+        self.markers = sorted({rule.after for rule in rules if rule.after})
+        self.by_name = {rule.name: rule for rule in rules}
+
+    def collector(self):
+        return DescriptionCollector(self)
+
+    def match(self, scope, text, markers_seen=()):
+        # (code, description, rule) from the first rule of the scope that
+        # matches text, or None
+        rules = self.scopes.get(scope)
+        if not rules:
+            return None
+        body = NOTE_PATTERN.sub('', text).strip() if scope in NOTE_SCOPES else text
+        last = body[-1:]
+        for pattern, rule in rules:
+            if rule.tail and last not in rule.tail:
+                continue
+            if rule.literal and rule.literal not in body:
+                continue
+            if rule.after and rule.after not in markers_seen:
+                continue
+            match = pattern.search(body)
+            if match is None:
+                continue
+            desc = match.group('desc').strip(' -–')  # Remove leading/trailing dashes
+            if desc:
+                return match.group('code'), desc, rule
+        return None
+
+class DescriptionCollector:
+    # Descriptions of one document, fed every paragraph, row and cell once
+    def __init__(self, rule_set):
+        self.rule_set = rule_set
+        self.markers_seen = set()
+        self.markers_pending = list(rule_set.markers)
+        self.best = {}
+
+    def add(self, scope, text):
+        match = self.rule_set.match(scope, text, self.markers_seen)
+        if match:
+            self.offer(*match)
+        if scope == 'paragraph':
+            self.see_markers(text)
+
+    def see_markers(self, text):
+        # Markers count from the paragraph after the one containing them
+        if self.markers_pending:
+            for marker in [marker for marker in self.markers_pending if marker in text]:
+                self.markers_seen.add(marker)
+                self.markers_pending.remove(marker)
+
+    def offer(self, code, desc, rule):
+        current = self.best.get(code)
+        if (current is None or rule.precedence > current[0]
+                or (rule.precedence == current[0] and not rule.keep_first)):
+            self.best[code] = (rule.precedence, desc)
+
+    def descriptions(self):
+        return {code: desc for code, (precedence, desc) in self.best.items()}
@@ -0,0 +1,106 @@
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from lxml import etree
+
+import docx_stream
+from docx_stream import (R_ID, W_FOOTER_REF, W_HEADER_REF, W_NS, W_TYPE, block_paragraphs,
+                         deep_cell_text, paragraph_text, text_boxes)
+
+# All-parts extraction engine. The python-docx and streaming engines read
+# what python-docx shows: body paragraphs, top-level tables and each
+# section's default header and footer. This one also reads tables nested in
+# cells, text boxes, first-page and even-page headers and footers, footnotes,
+# endnotes and comments. Every part of the zip is parsed once:
+#   - document.xml is streamed as in docx_stream, nested tables adding to
+#     their cell's text and text boxes following their paragraph or row as
+#     'textbox' blocks;
+#   - headers and footers shared by several sections are read, and yielded,
+#     once, for the first section using them;
+#   - footnotes, endnotes and comments yield one block per note or comment.
+# The other parts do not depend on document.xml, so they are parsed on a
+# thread pool while the body is streamed.
+
+PART_WORKERS = 4
+
+W_FOOTNOTE = '{%s}footnote' % W_NS
+W_ENDNOTE = '{%s}endnote' % W_NS
+W_COMMENT = '{%s}comment' % W_NS
+
+REL_TYPE_PREFIX = docx_stream.R_NS + '/'
+
+# Relationship type -> (block kind, element of each note) for the parts read
+NOTE_PARTS = {
+    'footnotes': ('footnote', W_FOOTNOTE),
+    'endnotes': ('endnote', W_ENDNOTE),
+    'comments': ('comment', W_COMMENT),
+}
+SECTION_PARTS = {'header', 'footer'}
+
+def part_texts(elem):
+    # Paragraph texts of a header, footer, note or comment, its text boxes last
+    texts = [paragraph_text(p) for p in block_paragraphs(elem)]
+    for box in text_boxes(elem):
+        texts.extend(box)
+    return texts
+
+def _read_part(zf, part_name, rel_kind):
+    # Parse one part: a list of paragraph texts for a header or footer, a
+    # list of them per note or comment otherwise. Separator notes, which
+    # hold no text of their own, are skipped.
+    root = etree.fromstring(zf.read(part_name))
+    if rel_kind in SECTION_PARTS:
+        return part_texts(root)
+    note_tag = NOTE_PARTS[rel_kind][1]
+    return [part_texts(note) for note in root.iterchildren(note_tag)
+            if note.get(W_TYPE) is None]
+
+def _all_section_refs(sect_pr):
+    # Every header and footer of a section (default, first page, even pages)
+    refs = []
+    for ref in sect_pr.iterchildren(W_HEADER_REF, W_FOOTER_REF):
+        refs.append(('header' if ref.tag == W_HEADER_REF else 'footer', ref.get(R_ID)))
+    return refs
+
+def iter_blocks(file, max_workers=PART_WORKERS):
+    with zipfile.ZipFile(file) as zf, ThreadPoolExecutor(max_workers) as pool:
+        document_name = docx_stream.main_document_name(zf)
+        rels = docx_stream.read_rels(zf, document_name)
+        names = set(zf.namelist())
+
+        # Start on every other part at once, each only once however many
+        # relationships point at it
+        parts = {}
+        for rel_type, part_name in rels.values():
+            if not rel_type.startswith(REL_TYPE_PREFIX):
+                continue
+            rel_kind = rel_type[len(REL_TYPE_PREFIX):]
+            if ((rel_kind in SECTION_PARTS or rel_kind in NOTE_PARTS)
+                    and part_name in names and part_name not in parts):
+                parts[part_name] = (rel_kind, pool.submit(_read_part, zf, part_name, rel_kind))
+
+        sections = []
+        with zf.open(document_name) as xml:
+            yield from docx_stream.iter_body(xml, sections, read_cell=deep_cell_text,
+                                             section_refs=_all_section_refs,
+                                             with_text_boxes=True)
+
+        # A header or footer counts once, for the first section using it;
+        # later sections linked to it add nothing
+        seen = set()
+        for section_num, refs in enumerate(sections, 1):
+            for kind, r_id in refs:
+                part_name = rels.get(r_id, (None, None))[1]
+                if part_name in parts and part_name not in seen:
+                    seen.add(part_name)
+                    yield kind, section_num, parts[part_name][1].result()
+
+        for rel_kind in NOTE_PARTS:
+            kind = NOTE_PARTS[rel_kind][0]
+            number = 0
+            for part_kind, future in parts.values():
+                if part_kind != rel_kind:
+                    continue
+                for texts in future.result():
+                    number += 1
+                    yield kind, number, texts
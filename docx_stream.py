@@ -0,0 +1,297 @@
+import posixpath
+import zipfile
+from collections import namedtuple
+
+from lxml import etree
+
+# Streaming extraction engine: reads the .docx zip parts directly and walks
+# word/document.xml with an incremental parser instead of building the
+# python-docx object model. It yields the same blocks as app.iter_docx_blocks
+# and mirrors python-docx's rules (direct runs only, repeated cells for
+# horizontal spans, cell above for vMerge continuations, linked headers).
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+MC_NS = 'http://schemas.openxmlformats.org/markup-compatibility/2006'
+R_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+PKG_REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+OFFICE_DOCUMENT = R_NS + '/officeDocument'
+
+def _w(tag):
+    return '{%s}%s' % (W_NS, tag)
+
+W_BODY = _w('body')
+W_P = _w('p')
+W_R = _w('r')
+W_T = _w('t')
+W_TAB = _w('tab')
+W_BR = _w('br')
+W_CR = _w('cr')
+W_TBL = _w('tbl')
+W_TBL_GRID = _w('tblGrid')
+W_GRID_COL = _w('gridCol')
+W_TR = _w('tr')
+W_TC = _w('tc')
+W_TC_PR = _w('tcPr')
+W_GRID_SPAN = _w('gridSpan')
+W_V_MERGE = _w('vMerge')
+W_SECT_PR = _w('sectPr')
+W_HEADER_REF = _w('headerReference')
+W_FOOTER_REF = _w('footerReference')
+W_VAL = _w('val')
+W_TYPE = _w('type')
+W_SDT = _w('sdt')
+W_SDT_CONTENT = _w('sdtContent')
+W_CUSTOM_XML = _w('customXml')
+W_TXBX_CONTENT = _w('txbxContent')
+MC_FALLBACK = '{%s}Fallback' % MC_NS
+R_ID = '{%s}id' % R_NS
+
+# Elements holding block-level content (paragraphs and tables) below them
+BLOCK_CONTAINERS = frozenset([W_TBL, W_TR, W_TC, W_SDT, W_SDT_CONTENT, W_CUSTOM_XML])
+
+def paragraph_text(p):
+    # Same as python-docx Paragraph.text: only runs that are direct children
+    text = []
+    for r in p.iterchildren(W_R):
+        for child in r:
+            if child.tag == W_T:
+                text.append(child.text or '')
+            elif child.tag == W_TAB:
+                text.append('\t')
+            elif child.tag in (W_BR, W_CR):
+                text.append('\n')
+    return ''.join(text)
+
+def cell_text(tc):
+    return '\n'.join(paragraph_text(p) for p in tc.iterchildren(W_P))
+
+def block_paragraphs(elem):
+    # Every paragraph of the block-level content below elem in document order,
+    # through nested tables and content controls but not into text boxes,
+    # which sit inside runs
+    for child in elem:
+        if child.tag == W_P:
+            yield child
+        elif child.tag in BLOCK_CONTAINERS:
+            yield from block_paragraphs(child)
+
+def deep_cell_text(tc):
+    # Like cell_text, with the text of tables nested in the cell
+    return '\n'.join(paragraph_text(p) for p in block_paragraphs(tc))
+
+def text_boxes(elem):
+    # Paragraph texts of each text box below elem. A text box drawn for
+    # newer Word is usually repeated as a VML fallback for older versions;
+    # the fallback copy is skipped.
+    boxes = []
+    for content in elem.iter(W_TXBX_CONTENT):
+        if next(content.iterancestors(MC_FALLBACK), None) is None:
+            boxes.append([paragraph_text(p) for p in block_paragraphs(content)])
+    return boxes
+
+def _cell_layout(tc):
+    grid_span, v_merge = 1, None
+    tc_pr = tc.find(W_TC_PR)
+    if tc_pr is not None:
+        span = tc_pr.find(W_GRID_SPAN)
+        if span is not None:
+            grid_span = int(span.get(W_VAL))
+        merge = tc_pr.find(W_V_MERGE)
+        if merge is not None:
+            v_merge = merge.get(W_VAL, 'continue')
+    return grid_span, v_merge
+
+# One grid row of a table. texts holds the text at every grid column, with a
+# merged cell's text repeated as python-docx's row.cells does; cells holds the
+# text of each physical cell once, in the row where the cell starts.
+TableRow = namedtuple('TableRow', 'texts cells')
+
+class TableGrid:
+    # Table model built once per table, a w:tr at a time. Every physical cell
+    # (w:tc) has its text read once, by read_cell, and gets a number; the grid
+    # holds that number at each position the cell spans, following
+    # python-docx's flattened layout: horizontal spans repeat the cell, vMerge
+    # continuations take the cell above and rows are cut every col_count
+    # positions. Only the last grid row is kept.
+    def __init__(self, col_count=0, read_cell=cell_text):
+        self.col_count = col_count
+        self.read_cell = read_cell
+        self.rows_seen = 0
+        self.rows_emitted = 0
+        self.cell_count = 0
+        self.cells_emitted = 0
+        self.pending = []
+        self.previous = []
+
+    def add_row(self, tr):
+        self.rows_seen += 1
+        for tc in tr.iterchildren(W_TC):
+            grid_span, v_merge = _cell_layout(tc)
+            for span_idx in range(grid_span):
+                if v_merge == 'continue':
+                    cell = self._above()
+                elif span_idx > 0:
+                    cell = self.pending[-1]
+                else:
+                    cell = (self.cell_count, self.read_cell(tc).strip())
+                    self.cell_count += 1
+                self.pending.append(cell)
+        return self._full_rows()
+
+    def finish(self):
+        rows = self._full_rows()
+        while self.rows_emitted < self.rows_seen:
+            rows.append(self._row(self.pending[:self.col_count]))
+            self.pending = self.pending[self.col_count:]
+            self.rows_emitted += 1
+        return rows
+
+    def _above(self):
+        window = self.previous + self.pending
+        return window[-self.col_count]
+
+    def _full_rows(self):
+        rows = []
+        while (self.col_count and len(self.pending) >= self.col_count
+               and self.rows_emitted < self.rows_seen):
+            row = self.pending[:self.col_count]
+            self.pending = self.pending[self.col_count:]
+            self.previous = row
+            self.rows_emitted += 1
+            rows.append(self._row(row))
+        return rows
+
+    def _row(self, row):
+        # Cells are numbered in grid order, so a cell is new to this row
+        # unless an earlier row already reached its number
+        cells = []
+        for number, text in row:
+            if number >= self.cells_emitted:
+                cells.append(text)
+                self.cells_emitted = number + 1
+        return TableRow([text for number, text in row], cells)
+
+def read_rels(zf, part_name):
+    rels_name = posixpath.join(posixpath.dirname(part_name), '_rels',
+                               posixpath.basename(part_name) + '.rels')
+    try:
+        root = etree.fromstring(zf.read(rels_name))
+    except KeyError:
+        return {}
+    base = posixpath.dirname(part_name)
+    rels = {}
+    for rel in root.iterchildren('{%s}Relationship' % PKG_REL_NS):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(base, target))
+        rels[rel.get('Id')] = (rel.get('Type'), target)
+    return rels
+
+def main_document_name(zf):
+    for rel_type, target in read_rels(zf, '').values():
+        if rel_type == OFFICE_DOCUMENT:
+            return target
+    return 'word/document.xml'
+
+def _section_refs(sect_pr):
+    refs = {}
+    for tag, key in ((W_HEADER_REF, 'Header'), (W_FOOTER_REF, 'Footer')):
+        for ref in sect_pr.iterchildren(tag):
+            if ref.get(W_TYPE) == 'default':
+                refs[key] = ref.get(R_ID)
+                break
+    return refs
+
+def _part_paragraph_texts(zf, part_name):
+    root = etree.fromstring(zf.read(part_name))
+    return [paragraph_text(p) for p in root.iterchildren(W_P)]
+
+def iter_body(xml, sections, read_cell=cell_text, section_refs=_section_refs,
+              with_text_boxes=False):
+    # Blocks of the body of document.xml, read from the xml stream. The
+    # header/footer references of each section, as section_refs gives them,
+    # are appended to sections. With with_text_boxes, the text boxes of each
+    # body paragraph and table row follow it as 'textbox' blocks.
+    paragraph_num = 0
+    table_num = 0
+    text_box_num = 0
+    grid = None
+    depth = 0
+
+    for event, elem in etree.iterparse(
+            xml, events=('start', 'end'), resolve_entities=False):
+        if event == 'start':
+            depth += 1
+            if depth == 3 and elem.tag == W_TBL:
+                table_num += 1
+                grid = TableGrid(read_cell=read_cell)
+                yield 'table', table_num, None
+            continue
+
+        depth -= 1
+        if depth == 3 and grid is not None:
+            # Direct children of a body-level table
+            if elem.tag == W_TBL_GRID:
+                grid.col_count = len(elem.findall(W_GRID_COL))
+            elif elem.tag == W_TR:
+                for row in grid.add_row(elem):
+                    yield 'row', table_num, row
+            for sect_pr in elem.iter(W_SECT_PR):
+                sections.append(section_refs(sect_pr))
+        elif depth == 2:
+            # Body-level block
+            if elem.tag == W_P:
+                paragraph_num += 1
+                yield 'paragraph', paragraph_num, paragraph_text(elem)
+            elif elem.tag == W_TBL:
+                for row in grid.finish():
+                    yield 'row', table_num, row
+                grid = None
+            for sect_pr in elem.iter(W_SECT_PR):
+                sections.append(section_refs(sect_pr))
+        else:
+            continue
+
+        if with_text_boxes and (depth == 2 or elem.tag == W_TR):
+            for texts in text_boxes(elem):
+                text_box_num += 1
+                yield 'textbox', text_box_num, texts
+        _release(elem)
+
+def iter_blocks(file):
+    with zipfile.ZipFile(file) as zf:
+        document_name = main_document_name(zf)
+        sections = []
+        with zf.open(document_name) as xml:
+            yield from iter_body(xml, sections)
+
+        # Headers and footers, following python-docx's "linked to previous"
+        # rule and reading each shared part once
+        rels = read_rels(zf, document_name)
+        part_texts = {}
+        current = {}
+        for section_num, refs in enumerate(sections, 1):
+            for kind in ('Header', 'Footer'):
+                if kind in refs:
+                    current[kind] = refs[kind]
+                r_id = current.get(kind)
+                texts = []
+                if r_id in rels:
+                    part_name = rels[r_id][1]
+                    if part_name not in part_texts:
+                        part_texts[part_name] = _part_paragraph_texts(zf, part_name)
+                    texts = part_texts[part_name]
+                yield kind.lower(), section_num, texts
+
+def _release(elem):
+    # Drop the finished element and everything before it so the tree never
+    # holds more than the block currently being read
+    elem.clear()
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
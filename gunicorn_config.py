@@ -1,4 +1,27 @@
+import os
+import shutil
+import tempfile
+
 workers = 4
 worker_class = 'gthread'
 threads = 2
 timeout = 120
+
+# Import the app once in the master and fork the workers from it, instead of
+# every worker importing it on its own after a cold start. A code change then
+# needs a restart rather than a HUP.
+preload_app = True
+
+def on_starting(server):
+    # Start /metrics from zero: files left by workers of an earlier run would be summed in
+    directory = os.environ.get('METRICS_DIR',
+                               os.path.join(tempfile.gettempdir(), 'werscode-metrics'))
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def when_ready(server):
+    # Runs in the master before any worker is forked: warm the preloaded app
+    # up so workers start with the parser, regexes and templates loaded
+    if server.cfg.preload_app:
+        from app import warm_up
+        warm_up(server.app.wsgi())
@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_files import atomic_write_json
+
+# Background jobs for large uploads. Job state lives in a JobStore so that any
+# gunicorn worker can answer status polls for a job another worker is running.
+# FileJobStore keeps one directory per job under a shared folder; a store
+# backed by another service only needs the same create/update/get/path/sweep
+# methods. Work runs on a bounded thread pool inside the worker process, so
+# no extra process is needed.
+
+class JobQueueFull(Exception):
+    pass
+
+class FileJobStore:
+    def __init__(self, directory, ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+
+    def create(self):
+        # The store's directory is created with the first job
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.path(job_id))
+        self.update(job_id, state='queued', stage='queued', percent=0, created=time.time())
+        return job_id
+
+    def path(self, job_id, name=None):
+        job_dir = os.path.join(self.directory, job_id)
+        return os.path.join(job_dir, name) if name else job_dir
+
+    def get(self, job_id):
+        # Job ids come from URLs, so only accept the hex form create() produces
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self.path(job_id, 'status.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **fields):
+        status = self.get(job_id) or {'id': job_id}
+        status.update(fields, updated=time.time())
+        self._write_json(job_id, 'status.json', status)
+        return status
+
+    def save_result(self, job_id, result):
+        self._write_json(job_id, 'result.json', result)
+
+    def load_result(self, job_id):
+        try:
+            with open(self.path(job_id, 'result.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def sweep(self):
+        # Remove jobs older than ttl together with their uploads and results
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            job_dir = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(job_dir) >= self.ttl:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+            except OSError:
+                pass
+
+    def _write_json(self, job_id, name, data):
+        # Pollers in other workers never read half a file
+        atomic_write_json(self.path(job_id, name), data)
+
+class JobRunner:
+    # At most max_workers jobs run at once and at most max_pending wait;
+    # submissions beyond that are refused rather than queued without bound
+    def __init__(self, store, max_workers=2, max_pending=8):
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._slots = threading.BoundedSemaphore(max_workers + max_pending)
+
+    def submit(self, job_id, work):
+        # work(progress) returns the job result; progress(stage, percent) records status
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull()
+        self._executor.submit(self._run, job_id, work)
+
+    def _run(self, job_id, work):
+        try:
+            self.store.update(job_id, state='running', stage='starting', percent=0)
+
+            def progress(stage, percent):
+                self.store.update(job_id, stage=stage, percent=percent)
+
+            result = work(progress)
+            self.store.save_result(job_id, result)
+            self.store.update(job_id, state='done', stage='done', percent=100)
+        except Exception as exc:
+            self.store.update(job_id, state='failed', stage='failed', error=str(exc))
+        finally:
+            self._slots.release()
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+
+from atomic_files import atomic_write_json
+
+# Counters and histograms in the Prometheus text format. Every gunicorn
+# worker keeps its own values and writes them to <pid>.json in a directory
+# shared by all workers; the /metrics page sums the files, so whichever
+# worker answers the scrape reports the totals of all of them. Files of
+# workers that have exited are kept so counters never go backwards; the
+# directory is emptied when gunicorn starts (see gunicorn_config.py).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._counters = {}
+        self._histograms = {}
+        self._values = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._pid = os.getpid()
+
+    def counter(self, name, help_text):
+        self._counters[name] = help_text
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._histograms[name] = (help_text, tuple(buckets))
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            values = self._own_values()
+            key = (name, _label_key(labels))
+            values[key] = values.get(key, 0) + amount
+            self._dirty = True
+
+    def observe(self, name, value, **labels):
+        buckets = self._histograms[name][1]
+        with self._lock:
+            values = self._own_values()
+            key = (name, _label_key(labels))
+            # Bucket counts (not yet cumulative), then the sum
+            entry = values.setdefault(key, [0] * (len(buckets) + 1) + [0.0])
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            else:
+                entry[len(buckets)] += 1
+            entry[-1] += value
+            self._dirty = True
+
+    def _own_values(self):
+        # A forked worker must not report what its parent recorded before the fork
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._values = {}
+        return self._values
+
+    def flush(self):
+        # Publish this process's values for the other workers; cheap when unchanged
+        if not self.directory:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            values = [[name, dict(labels), value]
+                      for (name, labels), value in self._own_values().items()]
+            self._dirty = False
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write_json(os.path.join(self.directory, f'{self._pid}.json'), values)
+
+    def collect(self):
+        # Values of all workers summed per metric and label set
+        self.flush()
+        totals = {}
+        for values in self._published():
+            for name, labels, value in values:
+                key = (name, _label_key(labels))
+                if isinstance(value, list):
+                    entry = totals.setdefault(key, [0] * len(value))
+                    for i, part in enumerate(value):
+                        entry[i] += part
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _published(self):
+        if not self.directory:
+            with self._lock:
+                yield [[name, dict(labels), value]
+                       for (name, labels), value in self._own_values().items()]
+            return
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                # A worker's file may be mid-replace or already gone
+                continue
+
+    def render(self):
+        totals = self.collect()
+        lines = []
+        for name, help_text in self._counters.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            samples = sorted((key[1], value) for key, value in totals.items() if key[0] == name)
+            if not samples:
+                samples = [((), 0)]
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_number(value)}')
+
+        for name, (help_text, buckets) in self._histograms.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            samples = sorted((key[1], value) for key, value in totals.items() if key[0] == name)
+            for labels, entry in samples:
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), entry[:-1]):
+                    cumulative += count
+                    le = (('le', _format_number(bound)),)
+                    lines.append(f'{name}_bucket{_format_labels(labels, le)} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_number(entry[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
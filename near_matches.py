@@ -0,0 +1,86 @@
+from collections import Counter
+
+# Suggestions for WERS codes that a document does not contain but nearly
+# does: a code pasted with a typo or an OCR slip (0 for O, 1 for I, two
+# characters swapped) otherwise just lands in "VOCI Only" or drops out.
+#
+# The document's 4-5 character tokens go into a deletion neighbourhood
+# index: each token is filed under itself and under every string left by
+# deleting one of its characters. Two strings one edit apart (a character
+# changed, inserted, deleted, or two neighbours swapped) always share one of
+# those keys, so a code is looked up under at most six keys and only the few
+# tokens found there are compared with it, however many tokens there are.
+
+SUGGESTION_LIMIT = 3
+
+# Characters OCR and hurried typing mix up; a change between them ranks first
+CONFUSABLE = {frozenset(pair) for pair in ('0O', '0D', '0Q', '1I', '1L', '2Z', '5S', '6G', '8B')}
+
+# Order of the kinds of edit, most likely first
+EDIT_RANK = {'confusable': 0, 'transposition': 1, 'substitution': 2,
+             'insertion': 3, 'deletion': 4}
+
+def _deletions(text):
+    # (position, text without the character there) for every position
+    return [(i, text[:i] + text[i + 1:]) for i in range(len(text))]
+
+class NearMatchIndex:
+    # keys maps a string to (token, position) pairs: the token itself is
+    # filed with position -1, each deletion with the position deleted
+    def __init__(self, tokens=()):
+        keys = self.keys = {}
+        for token in tokens:
+            keys.setdefault(token, []).append((token, -1))
+            for i, key in _deletions(token):
+                keys.setdefault(key, []).append((token, i))
+
+    def candidates(self, code):
+        # token -> kind of edit for the indexed tokens one edit away from
+        # code. The positions deleted from code and from the token tell the
+        # edit apart: none from the token is an insertion in it, none from
+        # code a deletion, the same one a changed character and neighbouring
+        # ones two swapped characters.
+        keys = self.keys
+        found = {}
+        for token, j in keys.get(code, ()):
+            if j >= 0:
+                found[token] = 'insertion'
+        for i, key in _deletions(code):
+            for token, j in keys.get(key, ()):
+                if j < 0:
+                    found[token] = 'deletion'
+                elif j == i:
+                    if token != code:
+                        found[token] = ('confusable' if frozenset((code[i], token[i])) in CONFUSABLE
+                                        else 'substitution')
+                elif (j == i + 1 or j == i - 1) and code[i] == token[j] and token != code:
+                    found.setdefault(token, 'transposition')
+        return found
+
+def suggest_near_matches(codes, code_indexes, exclude=(), limit=SUGGESTION_LIMIT):
+    # Near matches of each code among the tokens of the documents, given as
+    # their token -> hit count indexes. Tokens in exclude (codes that were
+    # asked for themselves) are never suggested. Returns code -> suggestions,
+    # best first, for the codes that have any.
+    exclude = set(exclude)
+    tokens = set().union(*code_indexes) - exclude
+    if not tokens:
+        return {}
+    index = NearMatchIndex(tokens)
+    total_hits = Counter()
+    for code_index in code_indexes:
+        total_hits.update(code_index)
+
+    suggestions = {}
+    for code in codes:
+        found = index.candidates(code)
+        if not found:
+            continue
+        ranked = sorted((EDIT_RANK[kind], -total_hits[token], token, kind)
+                        for token, kind in found.items())
+        suggestions[code] = [
+            {'code': token, 'edit': kind, 'hits': -negative_hits,
+             'documents': [number for number, code_index in enumerate(code_indexes, 1)
+                           if code_index.get(token)]}
+            for rank, negative_hits, token, kind in ranked[:limit]]
+    return suggestions
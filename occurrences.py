@@ -0,0 +1,63 @@
+# Where each code token of a parsed document appears. Positions are recorded
+# by ParsedDocument while it first scans the document for tokens, next to the text lines kept
+# for the report, so the context around an occurrence is a slice of a stored
+# line: nothing is scanned again to answer "where is this code".
+#
+# A position is a plain list, cheap to keep in the parse cache:
+#   ['paragraph', line, line_offset, offset, paragraph]
+#   ['table', line, line_offset, offset, table, row, cell]
+#   ['header' or 'footer', line, line_offset, offset, section]
+#   ['footnote', 'endnote', 'comment' or 'textbox', line, line_offset, offset, number],
+#   the numbered parts only the all-parts engine reads
+# line indexes the document's paragraph, table or part lines (by kind),
+# line_offset is where the token starts in that line and offset where it
+# starts in the paragraph, cell or header/footer paragraph itself. Numbers
+# count from 1 as in the report.
+
+SNIPPET_WIDTH = 40
+
+LOCATION_FIELDS = {
+    'paragraph': ('paragraph',),
+    'table': ('table', 'row', 'cell'),
+    'header': ('section',),
+    'footer': ('section',),
+    'footnote': ('number',),
+    'endnote': ('number',),
+    'comment': ('number',),
+    'textbox': ('number',),
+}
+
+class OccurrenceIndex:
+    def __init__(self, positions=None):
+        self.positions = positions if positions is not None else {}
+
+    def count(self, code):
+        return len(self.positions.get(code, ()))
+
+    def parts(self, code):
+        # The kinds of document part code appears in
+        return {position[0] for position in self.positions.get(code, ())}
+
+    def records(self, code, lines_by_kind, limit=None, width=SNIPPET_WIDTH):
+        # Occurrences of code with their location and a snippet of context
+        records = []
+        for position in self.positions.get(code, [])[:limit]:
+            kind, line, line_offset, offset = position[:4]
+            record = {'part': kind}
+            record.update(zip(LOCATION_FIELDS[kind], position[4:]))
+            record['offset'] = offset
+            # Table snippets may run into the neighbouring cells of the row;
+            # others start no earlier than the paragraph's own text
+            first = 0 if kind == 'table' else line_offset - offset
+            record['snippet'] = snippet(lines_by_kind[kind][line], line_offset, len(code),
+                                        width, first)
+            records.append(record)
+        return records
+
+def snippet(line, start, length, width=SNIPPET_WIDTH, first=0):
+    # Up to width characters either side of line[start:start + length],
+    # not reaching back before first
+    before = max(first, start - width)
+    after = start + length + width
+    text = line[before:after].replace('\n', ' ')
+    return ('…' if before > first else '') + text + ('…' if after < len(line) else '')
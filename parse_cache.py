@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from atomic_files import atomic_write_json
+
+# Content-addressed cache of parse results. Entries are keyed by the SHA-256
+# of the uploaded bytes and kept in two tiers: a small in-process LRU, and a
+# directory of JSON files that every gunicorn worker on the host shares.
+# Both tiers expire entries after ttl seconds.
+
+SWEEP_INTERVAL = 300
+
+def content_key(file, chunk_size=1 << 16):
+    # Hash the upload in chunks and rewind it so it can still be parsed
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b''):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+class ParseCache:
+    def __init__(self, directory=None, max_entries=16, ttl=86400):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if now - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        value = self._read(key, now)
+        if value is not None:
+            self._remember(key, value, now)
+        return value
+
+    def put(self, key, value):
+        now = time.time()
+        self._remember(key, value, now)
+        self._write(key, value)
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.sweep(now)
+
+    def sweep(self, now=None):
+        # Remove expired files from the shared directory
+        if not self.directory:
+            return
+        now = now or time.time()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) >= self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _remember(self, key, value, now):
+        with self._lock:
+            self._entries[key] = (now, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def _read(self, key, now):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if now - os.path.getmtime(path) >= self.ttl:
+                os.remove(path)
+                return None
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, value):
+        # A file that cannot be written only costs a later parse
+        if not self.directory:
+            return
+        try:
+            # Created on first use rather than at import
+            os.makedirs(self.directory, exist_ok=True)
+            atomic_write_json(self._path(key), value)
+        except OSError:
+            pass
@@ -0,0 +1,298 @@
+import csv
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+from atomic_files import atomic_write_chunks, atomic_write_json
+
+# Per-request report artifacts. Only a small manifest is stored for each
+# request (code results, time metrics and the content keys of the parsed
+# documents); the text report is generated from it chunk by chunk when it is
+# downloaded, pulling the extracted text back out of the parse cache.
+# The code table can also be downloaded as CSV, XLSX or JSON, generated the
+# same way; every export is written to disk as it streams and served from
+# there on later downloads.
+
+REPORT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+SWEEP_INTERVAL = 300
+
+# Manifests kept in memory for the results table's page requests
+RECENT_MANIFESTS = 8
+
+class ReportStore:
+    def __init__(self, directory, ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+        self._last_sweep = 0
+        self._recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        return uuid.uuid4().hex
+
+    def save(self, report_id, manifest):
+        # A download from another worker never reads half a file.
+        # The directory is created on first use rather than at import.
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write_json(self._path(report_id), manifest)
+
+        now = time.time()
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = now
+            self.sweep(now)
+
+    def load(self, report_id):
+        if not REPORT_ID_PATTERN.match(report_id):
+            return None
+        now = time.time()
+        with self._lock:
+            recent = self._recent.get(report_id)
+            if recent is not None and now - recent[0] < self.ttl:
+                self._recent.move_to_end(report_id)
+                return recent[1]
+
+        path = self._path(report_id)
+        try:
+            saved_at = os.path.getmtime(path)
+            if now - saved_at >= self.ttl:
+                return None
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        # Manifests never change once saved, so they can be kept as loaded
+        with self._lock:
+            self._recent[report_id] = (saved_at, manifest)
+            while len(self._recent) > RECENT_MANIFESTS:
+                self._recent.popitem(last=False)
+        return manifest
+
+    def sweep(self, now=None):
+        now = now or time.time()
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) >= self.ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def artifact(self, report_id, extension):
+        # Path of an export generated by an earlier download, if still there
+        path = self._artifact_path(report_id, extension)
+        return path if os.path.exists(path) else None
+
+    def cache_artifact(self, report_id, extension, chunks):
+        # Pass the chunks through; they become the cached artifact once the
+        # last one has been sent, and a download cut short leaves nothing
+        return atomic_write_chunks(self._artifact_path(report_id, extension), chunks)
+
+    def _path(self, report_id):
+        return os.path.join(self.directory, report_id + '.json')
+
+    def _artifact_path(self, report_id, extension):
+        return os.path.join(self.directory, f'{report_id}.export.{extension}')
+
+def _chunked(pieces, chunk_size):
+    # Join small pieces of text into chunks of roughly chunk_size characters
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def iter_report(manifest, load_lines, chunk_size=64 * 1024):
+    # Yield the text report in chunks of roughly chunk_size characters.
+    # load_lines(key) returns the extracted text lines of a parsed document,
+    # or None when they are no longer cached.
+    def lines():
+        time_metrics = manifest['time_metrics']
+        yield "WERS Code Analysis Results\n"
+        yield "=========================\n\n"
+
+        # Write time metrics
+        yield "CFD Completion Time Estimate (WERS Codes Only):\n"
+        yield "-----------------------------------------\n"
+        yield f"Total WERS Codes (excluding VOCI-only): {time_metrics['total_codes']}\n"
+        yield f"Total Minutes (4 mins per code): {time_metrics['total_minutes']}\n"
+        yield f"Total Hours: {time_metrics['total_hours']}\n"
+        yield f"Total Working Days (8hrs/day + 1 day buffer): {time_metrics['total_days']}\n"
+        yield "Note: 1 day buffer is added for entity and MPV$ codes\n\n"
+
+        # Write the content of every document
+        for number, key in enumerate(manifest['documents'], 1):
+            yield f"Extracted Text from Document {number}:\n"
+            yield "--------------------------\n"
+            text_lines = load_lines(key)
+            if text_lines is None:
+                yield "(extracted text is no longer cached; upload the document again)"
+            else:
+                for i, line in enumerate(text_lines):
+                    yield line if i == 0 else '\n' + line
+            yield "\n\n"
+
+        # Write analysis results
+        yield "Analysis Results:\n"
+        yield "----------------\n"
+        for code, result in manifest['code_results']:
+            yield f"{code}: {result['source']} - {result['description']}\n"
+
+    return _chunked(lines(), chunk_size)
+
+# Columns of the code table exports
+EXPORT_COLUMNS = ['code', 'source', 'description', 'hits', 'in_voci', 'documents']
+
+def _table_rows(manifest):
+    for code, result in manifest['code_results']:
+        yield [code, result['source'], result['description'], result['hits'],
+               result['in_voci'], ' '.join(map(str, result['documents']))]
+
+def iter_csv(manifest, chunk_size=64 * 1024):
+    # With a byte order mark so Excel reads the descriptions as UTF-8
+    def lines():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        yield '\ufeff'
+        writer.writerow(EXPORT_COLUMNS)
+        for row in _table_rows(manifest):
+            writer.writerow(row)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
+
+    return _chunked(lines(), chunk_size)
+
+def iter_json(manifest, chunk_size=64 * 1024):
+    # One object with the time metrics and a list of code records, written
+    # record by record
+    def pieces():
+        yield '{"time_metrics": ' + json.dumps(manifest['time_metrics'])
+        yield ', "code_lists": ' + json.dumps(manifest.get('code_lists', {}))
+        if 'near_matches' in manifest:
+            yield ', "near_matches": ' + json.dumps(manifest['near_matches'])
+        yield ', "codes": ['
+        for i, (code, result) in enumerate(manifest['code_results']):
+            record = dict(result, code=code)
+            yield (', ' if i else '') + json.dumps(record)
+        yield ']}\n'
+
+    return _chunked(pieces(), chunk_size)
+
+# Characters XML 1.0 does not allow, even escaped
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Codes" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'),
+}
+
+class _ZipOutput(io.RawIOBase):
+    # Write-only, unseekable sink for ZipFile; the bytes written so far are
+    # taken out between rows
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+def _xlsx_cell(value):
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, int):
+        return f'<c><v>{value}</v></c>'
+    text = escape(XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _xlsx_row(values):
+    return ('<row>' + ''.join(map(_xlsx_cell, values)) + '</row>').encode('utf-8')
+
+def iter_xlsx(manifest, chunk_size=64 * 1024):
+    # A one-sheet workbook with inline strings. The sheet is deflated as its
+    # rows are written and the zip goes out in chunks, without the whole
+    # workbook ever being in memory.
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in XLSX_PARTS.items():
+            zf.writestr(name, content)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                        b'<sheetData>')
+            sheet.write(_xlsx_row(EXPORT_COLUMNS))
+            for row in _table_rows(manifest):
+                sheet.write(_xlsx_row(row))
+                if output.size >= chunk_size:
+                    yield output.take()
+            sheet.write(b'</sheetData></worksheet>')
+    yield output.take()
+
+EXPORT_MIMETYPES = {
+    'txt': 'text/plain; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'json': 'application/json',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+def iter_export(extension, manifest, load_lines):
+    # The download of one of EXPORT_MIMETYPES' formats, as chunks of bytes
+    if extension == 'xlsx':
+        return iter_xlsx(manifest)
+    if extension == 'txt':
+        chunks = iter_report(manifest, load_lines)
+    elif extension == 'csv':
+        chunks = iter_csv(manifest)
+    else:
+        chunks = iter_json(manifest)
+    return (chunk.encode('utf-8') for chunk in chunks)
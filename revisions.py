@@ -0,0 +1,139 @@
+import hashlib
+import json
+from collections import Counter
+
+# Incremental extraction between revisions of one document. Every paragraph,
+# table row and header/footer block is fingerprinted by its content, and the
+# description candidates and code tokens found in it are kept per
+# fingerprint. A new revision is still read block by block, but only blocks
+# whose fingerprint the previous revision does not have go through the
+# description rules and the token scan; the document-level descriptions and
+# code index are then folded from the per-block results in document order.
+
+def block_fingerprint(kind, content, context=()):
+    data = json.dumps([kind, content, list(context)], ensure_ascii=False)
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+def _count_tokens(token_pattern, texts):
+    tokens = Counter()
+    for text, count in Counter(texts).items():
+        for token in token_pattern.findall(text):
+            tokens[token] += count
+    return tokens
+
+def _extract_block(kind, content, rule_set, token_pattern, markers_seen):
+    # Description candidates and token counts of one block, as plain data
+    candidates = []
+    if kind == 'paragraph':
+        texts = [content]
+        match = rule_set.match('paragraph', content, markers_seen)
+        if match:
+            candidates.append(match)
+    elif kind == 'row':
+        texts = content.texts
+        if texts:
+            match = rule_set.match('row', ' '.join(texts))
+            if match:
+                candidates.append(match)
+            for cell_text in content.cells:
+                match = rule_set.match('cell', cell_text)
+                if match:
+                    candidates.append(match)
+    else:
+        texts = [text for text in content if text.strip()]
+    return {'tokens': _count_tokens(token_pattern, texts),
+            'candidates': [[code, desc, rule.name] for code, desc, rule in candidates]}
+
+class Revision:
+    # Block fingerprints of one document in order, with the result of every
+    # distinct block. extracted and reused count the blocks of this load; a
+    # revision restored from its state has none of either and is cached.
+    def __init__(self, key=None, blocks=None, results=None, cached=False):
+        self.key = key
+        self.blocks = blocks or []
+        self.results = results or {}
+        self.cached = cached
+        self.extracted = 0
+        self.reused = 0
+
+    def state(self):
+        return {'blocks': self.blocks, 'results': self.results}
+
+    @classmethod
+    def from_state(cls, key, state):
+        return cls(key, state['blocks'], state['results'], cached=True)
+
+    def fold(self, rule_set):
+        # Document-level code -> description map and token counts
+        collector = rule_set.collector()
+        code_index = Counter()
+        for fingerprint in self.blocks:
+            result = self.results[fingerprint]
+            code_index.update(result['tokens'])
+            for code, desc, rule_name in result['candidates']:
+                rule = rule_set.by_name.get(rule_name)
+                if rule is not None:
+                    collector.offer(code, desc, rule)
+        return collector.descriptions(), code_index
+
+def extract_revision(blocks, rule_set, token_pattern, previous=None):
+    # blocks come from an extraction engine; results of blocks the previous
+    # revision already has are reused rather than extracted again
+    known = previous.results if previous is not None else {}
+    revision = Revision()
+    markers = rule_set.collector()
+    for kind, number, content in blocks:
+        if kind == 'table':
+            continue
+        if kind == 'paragraph':
+            content = content.strip()
+            if not content:
+                continue
+            # Rules that depend on earlier headings make the context part of the block
+            fingerprint = block_fingerprint(kind, content, sorted(markers.markers_seen))
+        elif kind == 'row':
+            fingerprint = block_fingerprint(kind, [content.texts, content.cells])
+        else:
+            fingerprint = block_fingerprint(kind, content)
+
+        if fingerprint not in revision.results:
+            if fingerprint in known:
+                revision.results[fingerprint] = known[fingerprint]
+                revision.reused += 1
+            else:
+                revision.results[fingerprint] = _extract_block(
+                    kind, content, rule_set, token_pattern, markers.markers_seen)
+                revision.extracted += 1
+        revision.blocks.append(fingerprint)
+
+        if kind == 'paragraph':
+            markers.see_markers(content)
+    return revision
+
+def revision_delta(previous, current, rule_set, matcher=None):
+    # Codes added, removed and with a changed description between revisions.
+    # With a matcher only its codes are compared (by hits and description),
+    # otherwise every code that has a description in either revision.
+    old_descriptions, old_index = previous.fold(rule_set)
+    new_descriptions, new_index = current.fold(rule_set)
+    if matcher is not None:
+        old_hits = matcher.count_index(old_index)
+        new_hits = matcher.count_index(new_index)
+    else:
+        old_hits = {code: old_index[code] for code in old_descriptions}
+        new_hits = {code: new_index[code] for code in new_descriptions}
+    old_codes = set(old_hits) | (set(old_descriptions) if matcher is None else set())
+    new_codes = set(new_hits) | (set(new_descriptions) if matcher is None else set())
+
+    added = [{'code': code, 'description': new_descriptions.get(code, ''),
+              'hits': new_hits.get(code, 0)} for code in sorted(new_codes - old_codes)]
+    removed = [{'code': code, 'description': old_descriptions.get(code, ''),
+                'hits': old_hits.get(code, 0)} for code in sorted(old_codes - new_codes)]
+    changed = []
+    for code in sorted(old_codes & new_codes):
+        before = old_descriptions.get(code, '')
+        after = new_descriptions.get(code, '')
+        if before != after:
+            changed.append({'code': code, 'previous_description': before, 'description': after,
+                            'previous_hits': old_hits.get(code, 0), 'hits': new_hits.get(code, 0)})
+    return {'added': added, 'removed': removed, 'changed': changed}
@@ -0,0 +1,54 @@
+import os
+import zipfile
+from tempfile import SpooledTemporaryFile
+
+from flask import Request, current_app
+
+# Memory limits for uploads. Request bodies are capped by Flask's
+# MAX_CONTENT_LENGTH, uploaded files are spooled to disk once they grow past
+# UPLOAD_SPOOL_BYTES, and every .docx is checked against compressed and
+# decompressed size budgets from its zip directory before it is parsed, so a
+# zip bomb is refused without inflating any of it.
+
+class DocumentRejected(ValueError):
+    # The upload is not a readable .docx
+    status = 400
+
+class DocumentTooLarge(DocumentRejected):
+    # The upload is over one of the size budgets
+    status = 413
+
+class SpoolingRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_BYTES'],
+                                    mode='rb+')
+
+def check_document(file, name, max_bytes, max_uncompressed, max_ratio):
+    # Zip member sizes come from the central directory; zipfile never inflates
+    # a member past its recorded size, so these totals bound what parsing reads
+    file.seek(0, os.SEEK_END)
+    size = file.tell()
+    file.seek(0)
+    if size > max_bytes:
+        raise DocumentTooLarge(
+            f'{name} is {size / 2 ** 20:.1f} MB; the limit is {max_bytes / 2 ** 20:.1f} MB')
+    try:
+        with zipfile.ZipFile(file) as zf:
+            members = zf.infolist()
+    except zipfile.BadZipFile:
+        raise DocumentRejected(f'{name} is not a .docx file')
+    finally:
+        file.seek(0)
+
+    uncompressed = sum(member.file_size for member in members)
+    if uncompressed > max_uncompressed:
+        raise DocumentTooLarge(
+            f'{name} expands to {uncompressed / 2 ** 20:.1f} MB; the limit is '
+            f'{max_uncompressed / 2 ** 20:.1f} MB')
+    for member in members:
+        # Small parts can legitimately compress very well
+        if member.file_size > 2 ** 20 and member.file_size > max_ratio * member.compress_size:
+            raise DocumentTooLarge(
+                f'{name} has a part ({member.filename}) compressed more than '
+                f'{max_ratio}:1 and was refused')